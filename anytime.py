@@ -0,0 +1,110 @@
+import multiprocessing
+import queue
+import time
+
+from bruteforce import CommonFunctions, Stocks
+from branchandbound import BranchAndBound
+
+
+class AnytimeResult:
+    """
+    Best purchase list found within a time limit, with its distance to the proven upper bound
+    """
+    __slots__ = ('purchase_list', 'gain', 'upper_bound', 'proven_optimal')
+
+    def __init__(self, purchase_list: list, gain: float, upper_bound: float, proven_optimal: bool):
+        self.purchase_list = purchase_list
+        self.gain = gain
+        self.upper_bound = upper_bound
+        self.proven_optimal = proven_optimal
+
+    @property
+    def gap(self) -> float:
+        """
+        Relative gap between the gain and the upper bound, 0 for a proven optimal purchase list
+        :return: (upper bound - gain) / upper bound
+        :rtype: float
+        """
+        if self.proven_optimal or not self.upper_bound:
+            return 0.0
+        return max(0.0, (self.upper_bound - self.gain) / self.upper_bound)
+
+
+def stream_search(problem: tuple, root: tuple, results_queue: multiprocessing.Queue):
+    """
+    Runs the branch and bound search in a worker process, putting each better purchase list on the queue
+    and None once the whole tree is explored
+    :param problem: search data returned by BranchAndBound.build_problem
+    :type problem: tuple
+    :param root: search root, see BranchAndBound.search_subtree
+    :type root: tuple
+    :param results_queue: queue read by AnytimeSolver.anytime_calculation
+    :type results_queue: multiprocessing.Queue
+    """
+    BranchAndBound.search_subtree(
+        problem, root, on_improvement=lambda gain, positions: results_queue.put((gain, positions))
+    )
+    results_queue.put(None)
+
+
+class AnytimeSolver:
+    """
+    Branch and bound search with a time limit, returning the best purchase list found so far instead of nothing
+    """
+
+    def __init__(self, common_functions: CommonFunctions):
+        self.common_functions = common_functions
+        self.branch_and_bound = BranchAndBound(common_functions)
+
+    def anytime_calculation(self, purchase_limit: float, stocks: Stocks, time_limit: float) -> AnytimeResult:
+        """
+        Calculates the best purchase option within a time limit. The search runs in a worker process streaming
+        its improved purchase lists back through a queue, the worker is stopped when the time limit is reached.
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: float
+        :param stocks: all stock data
+        :type stocks: Stocks
+        :param time_limit: seconds allowed to the search
+        :type time_limit: float
+        :return: best purchase list found, its gain, the fractional upper bound and whether it is proven optimal
+        :rtype: AnytimeResult
+        """
+        deadline = time.monotonic() + time_limit
+        order, problem = self.branch_and_bound.build_problem(stocks)
+        root = (0, purchase_limit + self.branch_and_bound.LIMIT_TOLERANCE, 0, None)
+        upper_bound = self.branch_and_bound.fractional_bound(problem, root)
+        # The greedy purchase list is available before the worker even starts
+        best_gain, best_positions = self.branch_and_bound.search_greedy(problem, root)
+
+        results_queue = multiprocessing.Queue()
+        process = multiprocessing.Process(
+            target=stream_search, args=(problem, root, results_queue), name="anytime_search", daemon=True
+        )
+        process.start()
+        proven_optimal = False
+        while True:
+            remaining_time = deadline - time.monotonic()
+            if remaining_time <= 0:
+                break
+            try:
+                message = results_queue.get(timeout=remaining_time)
+            except queue.Empty:
+                break
+            if message is None:
+                proven_optimal = True
+                break
+            gain, positions = message
+            if gain > best_gain:
+                best_gain, best_positions = gain, positions
+
+        if not proven_optimal:
+            process.terminate()
+        process.join()
+        results_queue.close()
+
+        return AnytimeResult(
+            purchase_list=self.branch_and_bound.to_purchase_list(len(stocks), order, best_positions),
+            gain=best_gain,
+            upper_bound=best_gain if proven_optimal else upper_bound,
+            proven_optimal=proven_optimal
+        )
@@ -0,0 +1,279 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import random
+import time
+import tracemalloc
+
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from branchandbound import BranchAndBound
+from bruteforce import CommonFunctions, Stocks
+from certification import GAIN_TOLERANCE, gains_agree
+from optimized import Optimized
+from solvers import get_solvers
+
+
+BENCHMARK_DATASETS = ["test_datasets/dataset1.csv", "test_datasets/dataset2.csv"]
+SUITE_DATASETS = ["test_datasets/dataset0.csv", "test_datasets/dataset1.csv", "test_datasets/dataset2.csv"]
+SYNTHETIC_SIZES = [20, 100, 1000, 10000, 100000]
+# Maximum numbers of stocks overriding the ones of solvers.get_solvers, sized for the differential test on many
+# instances: a benchmark runs each solver once per dataset, the brute force and the legacy search on dataset0
+BENCHMARK_MAX_COUNTS = {'brute_force': 20, 'optimized_calculation': 20, 'knapsack_python': 1000}
+
+
+def time_knapsack_backend(optimized: Optimized, stocks: Stocks, purchase_limit: float, backend: str) -> tuple:
+    """
+    Times the knapsack calculation for a given backend, csv parsing excluded
+    :param optimized: optimized calculation controller
+    :type optimized: Optimized
+    :param stocks: all stocks data
+    :type stocks: Stocks
+    :param purchase_limit: maximum amount to be expended in stock purchases
+    :type purchase_limit: float
+    :param backend: 'numpy' or 'python'
+    :type backend: str
+    :return: elapsed seconds and best purchase list
+    :rtype: tuple
+    """
+    start_time = time.perf_counter()
+    best_list = optimized.knapsack_calculation(purchase_limit, stocks, backend=backend)
+    return time.perf_counter() - start_time, best_list
+
+
+def benchmark_knapsack_backends(file_paths: list = None, purchase_limit: float = 500) -> list:
+    """
+    Compares the pure python and the numpy knapsack backends on the given datasets
+    :param file_paths: datasets to be solved
+    :type file_paths: list
+    :param purchase_limit: maximum amount to be expended in stock purchases
+    :type purchase_limit: float
+    :return: one result dictionary per dataset
+    :rtype: list
+    """
+    common_functions = CommonFunctions()
+    optimized = Optimized(common_functions)
+    results = []
+    for file_path in file_paths if file_paths else BENCHMARK_DATASETS:
+        stocks = common_functions.csv_to_stocks(file_path)
+        python_time, python_list = time_knapsack_backend(optimized, stocks, purchase_limit, 'python')
+        numpy_time, numpy_list = time_knapsack_backend(optimized, stocks, purchase_limit, 'numpy')
+        results.append({
+            'dataset': file_path,
+            'python_seconds': round(python_time, 4),
+            'numpy_seconds': round(numpy_time, 4),
+            'speedup': round(python_time / numpy_time, 1),
+            'same_gain': stocks.total_gain(python_list) == stocks.total_gain(numpy_list)
+        })
+    return results
+
+
+def memory_lean_peak(stocks_count: int, purchase_limit: float, backend: str = None) -> float:
+    """
+    Solves a synthetic dataset in memory lean mode, meant to run in a fresh worker process
+    :param stocks_count: number of stocks
+    :type stocks_count: int
+    :param purchase_limit: maximum amount to be expended in stock purchases
+    :type purchase_limit: float
+    :param backend: 'numpy' or 'python', numpy when installed if not declared
+    :type backend: str
+    :return: peak RSS of the process in MB
+    :rtype: float
+    """
+    common_functions = CommonFunctions()
+    Optimized(common_functions).knapsack_calculation(
+        purchase_limit, generate_stocks(stocks_count, seed=stocks_count), memory_lean=True, backend=backend)
+    return common_functions.get_peak_memory()
+
+
+def check_memory_lean_ceiling(stocks_count: int = 10000, purchase_limit: float = 1000, backend: str = None) -> float:
+    """
+    Checks the peak RSS of the memory lean knapsack against Optimized.MEMORY_LEAN_CEILING_MB, 10,000 stocks and
+    a 100,000 units capacity by default. The solve runs in a spawned process, so that the peak only holds it.
+    :param stocks_count: number of stocks
+    :type stocks_count: int
+    :param purchase_limit: maximum amount to be expended in stock purchases
+    :type purchase_limit: float
+    :param backend: 'numpy' or 'python', numpy when installed if not declared
+    :type backend: str
+    :return: peak RSS in MB
+    :rtype: float
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        peak_memory = executor.submit(memory_lean_peak, stocks_count, purchase_limit, backend).result()
+    if peak_memory > Optimized.MEMORY_LEAN_CEILING_MB:
+        raise AssertionError(
+            f"memory lean knapsack peaked at {peak_memory} MB, over the {Optimized.MEMORY_LEAN_CEILING_MB} MB ceiling")
+    return peak_memory
+
+
+def generate_stocks(stocks_count: int, seed: int = 0) -> Stocks:
+    """
+    Generates a synthetic dataset like dataset1.csv: 2 decimals prices from 0.01 to 100 and gains from 0 to 50%
+    :param stocks_count: number of stocks
+    :type stocks_count: int
+    :param seed: random seed, the same seed gives the same dataset
+    :type seed: int
+    :return: generated stocks
+    :rtype: Stocks
+    """
+    generator = random.Random(seed)
+    return Stocks(
+        tuple(f"Share-{stock_index}" for stock_index in range(stocks_count)),
+        array('d', (generator.randint(1, 10000) / 100 for _ in range(stocks_count))),
+        array('d', (generator.randint(0, 5000) / 100 for _ in range(stocks_count)))
+    )
+
+
+def measure_solver(solver, purchase_limit: float, stocks: Stocks, measure_memory: bool = True) -> tuple:
+    """
+    Runs a solver once for its wall time, then once more under tracemalloc for its peak memory (memory of the
+    worker processes of the parallel and anytime solvers is not traced)
+    :param solver: function(purchase_limit, stocks) returning a purchase list
+    :type solver: callable
+    :param purchase_limit: maximum amount to be expended in stock purchases
+    :type purchase_limit: float
+    :param stocks: all stock data
+    :type stocks: Stocks
+    :param measure_memory: runs the solver a second time to measure its peak memory
+    :type measure_memory: bool
+    :return: wall time in seconds, peak memory in MB (None if not measured) and purchase list
+    :rtype: tuple
+    """
+    start_time = time.perf_counter()
+    purchase_list = solver(purchase_limit, stocks)
+    wall_time = time.perf_counter() - start_time
+    peak_memory = None
+    if measure_memory:
+        tracemalloc.start()
+        solver(purchase_limit, stocks)
+        peak_memory = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 3)
+        tracemalloc.stop()
+    return wall_time, peak_memory, purchase_list
+
+
+def run_benchmark_suite(
+        file_paths: list = None,
+        synthetic_sizes: list = None,
+        purchase_limit: float = 500,
+        measure_memory: bool = True,
+        max_counts: dict = None
+) -> list:
+    """
+    Runs every solver on the datasets and on synthetic datasets, checking their gains against the exact optimum.
+    Stocks are sanitized once per dataset, before the solvers (see CommonFunctions.sanitize_stocks), so that every
+    price is positive, and the solvers of solvers.get_solvers are skipped on datasets larger than their maximum
+    number of stocks (overridden by max_counts).
+    :param file_paths: csv datasets to be solved
+    :type file_paths: list
+    :param synthetic_sizes: numbers of stocks of the synthetic datasets
+    :type synthetic_sizes: list
+    :param purchase_limit: maximum amount to be expended in stock purchases
+    :type purchase_limit: float
+    :param measure_memory: measures the peak memory of each solver
+    :type measure_memory: bool
+    :param max_counts: solver name: maximum number of stocks (None for no maximum), BENCHMARK_MAX_COUNTS if not
+    declared
+    :type max_counts: dict
+    :return: one result dictionary per dataset and solver
+    :rtype: list
+    """
+    common_functions = CommonFunctions()
+    max_counts = BENCHMARK_MAX_COUNTS if max_counts is None else max_counts
+    solvers = get_solvers(common_functions)
+    datasets = [(file_path, common_functions.csv_to_stocks(file_path)) for file_path in
+                (SUITE_DATASETS if file_paths is None else file_paths)]
+    datasets += [(f"synthetic-{size}", generate_stocks(size, seed=size)) for size in
+                 (SYNTHETIC_SIZES if synthetic_sizes is None else synthetic_sizes)]
+
+    results = []
+    for dataset_name, stocks in datasets:
+        start_time = time.perf_counter()
+        sanitized_stocks, _ = common_functions.sanitize_stocks(stocks, purchase_limit)
+        sanitize_time = time.perf_counter() - start_time
+        # The branch and bound is exact on the real valued prices and the fastest on every dataset size
+        optimal_gain = sanitized_stocks.total_gain(
+            BranchAndBound(common_functions).branch_and_bound_calculation(purchase_limit, sanitized_stocks))
+
+        for solver_name, solver, max_count, exact, _ in solvers:
+            max_count = max_counts.get(solver_name, max_count)
+            if max_count is not None and len(sanitized_stocks) > max_count:
+                continue
+            wall_time, peak_memory, purchase_list = measure_solver(
+                solver, purchase_limit, sanitized_stocks, measure_memory)
+            gain = sanitized_stocks.total_gain(purchase_list)
+            results.append({
+                'dataset': dataset_name,
+                'stocks': len(stocks),
+                'sanitized_stocks': len(sanitized_stocks),
+                'sanitize_seconds': round(sanitize_time, 6),
+                'solver': solver_name,
+                'exact': exact,
+                'seconds': round(wall_time, 6),
+                'peak_memory_mb': peak_memory,
+                'gain': round(gain, 6),
+                'optimal_gain': round(optimal_gain, 6),
+                'gap': round((optimal_gain - gain) / optimal_gain, 9) if optimal_gain else 0.0,
+                'agrees': gains_agree(gain, optimal_gain),
+                'feasible': sanitized_stocks.total_cost(purchase_list) <= purchase_limit + GAIN_TOLERANCE
+            })
+    return results
+
+
+def write_results(results: list, json_path: str = None, csv_path: str = None):
+    """
+    Writes benchmark results as JSON and / or CSV
+    :param results: results returned by run_benchmark_suite
+    :type results: list
+    :param json_path: JSON output file, not written if not declared
+    :type json_path: str
+    :param csv_path: CSV output file, not written if not declared
+    :type csv_path: str
+    """
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+    if csv_path and results:
+        with open(csv_path, 'w', encoding='utf-8', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=list(results[0].keys()))
+            writer.writeheader()
+            writer.writerows(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks all solvers across dataset sizes")
+    parser.add_argument('--json', help="JSON output file")
+    parser.add_argument('--csv', help="CSV output file")
+    parser.add_argument('--sizes', type=int, nargs='*', help="synthetic dataset sizes")
+    parser.add_argument('--no-memory', action='store_true', help="skip the peak memory runs")
+    parser.add_argument('--backends', action='store_true', help="only compare the knapsack backends")
+    parser.add_argument('--memory-ceiling', action='store_true', help="only check the memory lean knapsack ceiling")
+    arguments = parser.parse_args()
+
+    if arguments.memory_ceiling:
+        print(f"memory lean knapsack peak RSS: {check_memory_lean_ceiling()} MB, "
+              f"ceiling {Optimized.MEMORY_LEAN_CEILING_MB} MB")
+        return
+
+    if arguments.backends:
+        for result in benchmark_knapsack_backends():
+            print(
+                f"{result['dataset']}: python {result['python_seconds']}s, numpy {result['numpy_seconds']}s, "
+                f"x{result['speedup']}, same gain: {result['same_gain']}"
+            )
+        return
+
+    results = run_benchmark_suite(synthetic_sizes=arguments.sizes, measure_memory=not arguments.no_memory)
+    write_results(results, arguments.json, arguments.csv)
+    for result in results:
+        print(
+            f"{result['dataset']:<30} {result['solver']:<26} {result['seconds']:>10.4f}s "
+            f"{result['peak_memory_mb'] if result['peak_memory_mb'] is not None else '-':>10} MB "
+            f"gain {result['gain']:<14} gap {result['gap']:<12} agrees: {result['agrees']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
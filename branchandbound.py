@@ -0,0 +1,312 @@
+import multiprocessing
+import os
+import time
+
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate
+
+from bruteforce import CommonFunctions, Stocks
+from instrumentation import SolveStats, measure_phase
+
+
+class BranchAndBound:
+    """
+    Exact search on real valued prices, pruning every branch whose fractional knapsack upper bound
+    cannot beat the best purchase list found so far
+    """
+
+    # Relative margin added to upper bounds so that float rounding never prunes an optimal branch
+    BOUND_TOLERANCE = 1e-9
+    # Absolute margin on the purchase limit so that a purchase list costing exactly the limit stays feasible
+    LIMIT_TOLERANCE = 1e-9
+    # Number of nodes explored by a parallel search between two reads of the shared best gain
+    SHARE_INTERVAL = 1024
+
+    def __init__(self, common_functions: CommonFunctions):
+        self.common_functions = common_functions
+
+    @staticmethod
+    def sort_by_ratio(stocks: Stocks) -> list:
+        """
+        Sorts the positions of the stocks worth buying (positive price and gain) by decreasing gain / price ratio
+        :param stocks: all stock data
+        :type stocks: Stocks
+        :return: stock positions
+        :rtype: list
+        """
+        costs = stocks.costs
+        profits = stocks.profits
+        candidates = [
+            stock_index for stock_index in range(len(stocks)) if costs[stock_index] > 0 and profits[stock_index] > 0
+        ]
+        # gain / price is the gain percentage
+        return sorted(candidates, key=profits.__getitem__, reverse=True)
+
+    @classmethod
+    def build_problem(cls, stocks: Stocks) -> tuple:
+        """
+        Gets the search data of the stocks worth buying, sorted by ratio
+        :param stocks: all stock data
+        :type stocks: Stocks
+        :return: stock positions in ratio order and (costs, ratios, gains, prefix costs, prefix gains) lists
+        :rtype: tuple
+        """
+        order = cls.sort_by_ratio(stocks)
+        costs = [stocks.costs[stock_index] for stock_index in order]
+        ratios = [stocks.profits[stock_index] for stock_index in order]
+        gains = [stocks.gains[stock_index] for stock_index in order]
+        prefix_costs = list(accumulate(costs, initial=0))
+        prefix_gains = list(accumulate(gains, initial=0))
+        return order, (costs, ratios, gains, prefix_costs, prefix_gains)
+
+    @staticmethod
+    def taken_positions(best_taken: tuple) -> list:
+        """
+        Flattens a solution found by search_subtree
+        :param best_taken: linked list of the decided stocks taken, first and last + 1 greedily taken positions
+        :type best_taken: tuple
+        :return: taken positions in ratio order
+        :rtype: list
+        """
+        taken, start, end = best_taken
+        positions = list(range(start, end))
+        while taken is not None:
+            position, taken = taken
+            positions.append(position)
+        return sorted(positions)
+
+    @classmethod
+    def search_subtree(
+            cls, problem: tuple, root: tuple, best_gain: float = 0, shared_best=None, on_improvement=None,
+            stats: SolveStats = None
+    ) -> tuple:
+        """
+        Explores the include / exclude tree below a node. Running limit and gain are passed down to the children
+        and the fractional bound is found by binary search on the prefix sums, so a node costs O(log n).
+        :param problem: search data returned by build_problem
+        :type problem: tuple
+        :param root: (next stock to decide, remaining limit, running gain, stocks taken as a linked list of
+        (position, parent) tuples)
+        :type root: tuple
+        :param best_gain: gain to beat
+        :type best_gain: float
+        :param shared_best: best gain shared by the parallel searches, read and updated while searching
+        :type shared_best: multiprocessing.Value
+        :param on_improvement: called with the gain and taken positions of each better purchase list found
+        :type on_improvement: callable
+        :param stats: counts the nodes explored and the nodes pruned by the bound
+        :type stats: SolveStats
+        :return: best gain found and its taken positions in ratio order, None if best_gain was not beaten
+        :rtype: tuple
+        """
+        costs, ratios, gains, prefix_costs, prefix_gains = problem
+        stocks_count = len(costs)
+        bound_factor = 1 + cls.BOUND_TOLERANCE
+        found_gain = best_gain
+        best_taken = None
+        explored = 0
+        pruned = 0
+
+        stack = [root]
+        while stack:
+            index, remaining_limit, gain, taken = stack.pop()
+            explored += 1
+            if shared_best is not None and explored % cls.SHARE_INTERVAL == 0 and shared_best.value > best_gain:
+                best_gain = shared_best.value
+
+            # Stocks index to end - 1 all fit in the remaining limit, stock end is the fractional one
+            limit = prefix_costs[index] + remaining_limit
+            end = bisect_right(prefix_costs, limit, index) - 1
+            greedy_gain = gain + prefix_gains[end] - prefix_gains[index]
+            if greedy_gain > best_gain:
+                best_gain = found_gain = greedy_gain
+                best_taken = (taken, index, end)
+                if shared_best is not None:
+                    with shared_best.get_lock():
+                        if shared_best.value < best_gain:
+                            shared_best.value = best_gain
+                if on_improvement is not None:
+                    on_improvement(best_gain, cls.taken_positions(best_taken))
+            if end == stocks_count:
+                continue
+            bound = greedy_gain + (limit - prefix_costs[end]) * ratios[end]
+            if bound * bound_factor <= best_gain:
+                pruned += 1
+                continue
+
+            # Exclude branch is pushed first so that the include branch is explored first
+            if index + 1 < stocks_count:
+                stack.append((index + 1, remaining_limit, gain, taken))
+                cost = costs[index]
+                if cost <= remaining_limit:
+                    stack.append((index + 1, remaining_limit - cost, gain + gains[index], (index, taken)))
+
+        if stats is not None:
+            stats.count('nodes_explored', explored)
+            stats.count('nodes_pruned', pruned)
+        return found_gain, cls.taken_positions(best_taken) if best_taken is not None else None
+
+    @staticmethod
+    def search_greedy(problem: tuple, root: tuple) -> tuple:
+        """
+        Gets the greedy purchase list of a node: stocks taken in ratio order until one does not fit
+        :param problem: search data returned by build_problem
+        :type problem: tuple
+        :param root: node, see search_subtree
+        :type root: tuple
+        :return: greedy gain and taken positions in ratio order
+        :rtype: tuple
+        """
+        _, _, _, prefix_costs, prefix_gains = problem
+        index, remaining_limit, gain, taken = root
+        end = bisect_right(prefix_costs, prefix_costs[index] + remaining_limit, index) - 1
+        return gain + prefix_gains[end] - prefix_gains[index], BranchAndBound.taken_positions((taken, index, end))
+
+    @staticmethod
+    def fractional_bound(problem: tuple, root: tuple) -> float:
+        """
+        Gets the fractional knapsack upper bound of a node: greedy gain plus the fitting part of the next stock
+        :param problem: search data returned by build_problem
+        :type problem: tuple
+        :param root: node, see search_subtree
+        :type root: tuple
+        :return: upper bound of the gain of any purchase list below the node
+        :rtype: float
+        """
+        _, ratios, _, prefix_costs, prefix_gains = problem
+        index, remaining_limit, gain, _ = root
+        limit = prefix_costs[index] + remaining_limit
+        end = bisect_right(prefix_costs, limit, index) - 1
+        bound = gain + prefix_gains[end] - prefix_gains[index]
+        return bound if end == len(ratios) else bound + (limit - prefix_costs[end]) * ratios[end]
+
+    @staticmethod
+    def to_purchase_list(stocks_count: int, order: list, positions: list) -> list:
+        """
+        Gets the purchase list of the taken positions
+        :param stocks_count: number of stocks
+        :type stocks_count: int
+        :param order: stock positions in ratio order
+        :type order: list
+        :param positions: taken positions in ratio order
+        :type positions: list
+        :return: purchase list
+        :rtype: list
+        """
+        purchase_list = [0] * stocks_count
+        for position in positions if positions else []:
+            purchase_list[order[position]] = 1
+        return purchase_list
+
+    def branch_and_bound_calculation(self, purchase_limit: float, stocks: Stocks, stats: SolveStats = None) -> list:
+        """
+        Calculates the best purchase option exploring the include / exclude tree of the stocks sorted by ratio,
+        pruning the branches whose fractional bound cannot beat the best purchase list found so far
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: float
+        :param stocks: all stock data
+        :type stocks: Stocks
+        :param stats: collects the preprocess and solve times and the search node counters
+        :type stats: SolveStats
+        :return: best purchase list
+        :rtype: list
+        """
+        with measure_phase(stats, 'preprocess'):
+            order, problem = self.build_problem(stocks)
+        with measure_phase(stats, 'solve'):
+            _, positions = self.search_subtree(
+                problem, (0, purchase_limit + self.LIMIT_TOLERANCE, 0, None), stats=stats)
+        with measure_phase(stats, 'backtrack'):
+            return self.to_purchase_list(len(stocks), order, positions)
+
+    def parallel_branch_and_bound_calculation(
+            self, purchase_limit: float, stocks: Stocks, split_depth: int = None, max_workers: int = None
+    ) -> list:
+        """
+        Calculates the best purchase option on several cores. The decisions on the first split_depth stocks
+        are fixed to build up to 2 ** split_depth independent subtrees, searched by a process pool. Workers share
+        the best gain found so far so that each one prunes with the others' purchase lists.
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: float
+        :param stocks: all stock data
+        :type stocks: Stocks
+        :param split_depth: number of decisions fixed, enough for 4 subtrees per worker if not declared
+        :type split_depth: int
+        :param max_workers: number of processes, number of cores if not declared
+        :type max_workers: int
+        :return: best purchase list
+        :rtype: list
+        """
+        order, problem = self.build_problem(stocks)
+        costs, _, gains, _, _ = problem
+        max_workers = max_workers if max_workers else os.cpu_count()
+        split_depth = (4 * max_workers - 1).bit_length() if split_depth is None else split_depth
+        split_depth = min(split_depth, len(order))
+
+        # The greedy purchase list of the whole tree is the first incumbent
+        root = (0, purchase_limit + self.LIMIT_TOLERANCE, 0, None)
+        best_gain, best_positions = self.search_greedy(problem, root)
+
+        roots = [root]
+        for index in range(split_depth):
+            children = []
+            for _, remaining_limit, gain, taken in roots:
+                children.append((index + 1, remaining_limit, gain, taken))
+                if costs[index] <= remaining_limit:
+                    children.append((index + 1, remaining_limit - costs[index], gain + gains[index], (index, taken)))
+            roots = children
+
+        shared_best = multiprocessing.Value('d', best_gain)
+        with ProcessPoolExecutor(
+                max_workers=max_workers, initializer=init_parallel_worker, initargs=(problem, shared_best)
+        ) as executor:
+            for gain, positions in executor.map(search_parallel_subtree, roots):
+                if positions is not None and gain > best_gain:
+                    best_gain, best_positions = gain, positions
+        return self.to_purchase_list(len(stocks), order, best_positions)
+
+
+# Search data and best gain shared by the parallel search workers, set by init_parallel_worker
+worker_state = {}
+
+
+def init_parallel_worker(problem: tuple, shared_best):
+    """
+    Stores the search data and shared best gain in a parallel search worker
+    :param problem: search data returned by BranchAndBound.build_problem
+    :type problem: tuple
+    :param shared_best: best gain shared by the parallel searches
+    :type shared_best: multiprocessing.Value
+    """
+    worker_state['problem'] = problem
+    worker_state['shared_best'] = shared_best
+
+
+def search_parallel_subtree(root: tuple) -> tuple:
+    """
+    Searches a subtree in a parallel search worker
+    :param root: subtree root, see BranchAndBound.search_subtree
+    :type root: tuple
+    :return: best gain found and its taken positions, None if the shared best gain was not beaten
+    :rtype: tuple
+    """
+    shared_best = worker_state['shared_best']
+    return BranchAndBound.search_subtree(worker_state['problem'], root, shared_best.value, shared_best)
+
+
+def main():
+    common_functions = CommonFunctions()
+    branch_and_bound = BranchAndBound(common_functions)
+    for file_path in (common_functions.DATASET_FILE, "test_datasets/dataset1.csv", "test_datasets/dataset2.csv"):
+        start_time = time.time()
+        stocks, report = common_functions.sanitize_stocks(common_functions.csv_to_stocks(file_path), 500)
+        best_list = branch_and_bound.branch_and_bound_calculation(500, stocks)
+        print(file_path)
+        print(stocks.purchased_names(best_list))
+        print(stocks.total_gain(best_list))
+        print("--- %s seconds ---" % (time.time() - start_time))
+
+
+if __name__ == "__main__":
+    main()
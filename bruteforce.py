@@ -1,15 +1,112 @@
 import csv
+import logging
+import mmap
+import os
+import sys
 import time
 
+from array import array
+from bisect import bisect_left
+from itertools import compress
+from operator import mul
+
+from instrumentation import SolveStats, measure_phase
+
+try:
+    import resource
+except ImportError:
+    # resource is only available on Unix systems
+    resource = None
+
+try:
+    import numpy as np
+except ImportError:
+    # Input sanitization falls back on pure python filters
+    np = None
+
+logger = logging.getLogger(__name__)
+
+
+class Stocks:
+    """
+    Columnar stocks data: names, prices, gain percentages and gains as parallel sequences indexed by position,
+    with the optional extra csv columns (sector, risk bucket...) as attributes
+    """
+    __slots__ = ('names', 'costs', 'profits', 'gains', 'attributes')
+
+    def __init__(self, names: tuple, costs: array, profits: array, attributes: dict = None):
+        self.names = names
+        self.costs = costs
+        self.profits = profits
+        # gain of a single stock purchase, up to 2 numbers below 1 (price * gain percentage)
+        self.gains = array('d', map(mul, costs, profits))
+        # extra column name: tuple of the column values, indexed by position
+        self.attributes = attributes if attributes else {}
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def select(self, positions: list) -> 'Stocks':
+        """
+        Gets the stocks at the given positions
+        :param positions: positions of the stocks to keep
+        :type positions: list
+        :return: selected stocks, in the order of positions
+        :rtype: Stocks
+        """
+        return Stocks(
+            tuple(self.names[position] for position in positions),
+            array('d', (self.costs[position] for position in positions)),
+            array('d', (self.profits[position] for position in positions)),
+            {column: tuple(values[position] for position in positions) for column, values in self.attributes.items()}
+        )
+
+    def total_cost(self, purchase_list: list) -> float:
+        """
+        Calculates total cost of a series of purchases
+        :param purchase_list: purchase quantity for each stock
+        :type purchase_list: list
+        :return: total cost of all purchases
+        :rtype: float
+        """
+        return sum(map(mul, purchase_list, self.costs))
+
+    def total_gain(self, purchase_list: list) -> float:
+        """
+        Calculates total gain of a series of purchases
+        :param purchase_list: purchase quantity for each stock
+        :type purchase_list: list
+        :return: total gain up to 2 numbers below 1
+        :rtype: float
+        """
+        return sum(map(mul, purchase_list, self.gains))
+
+    def purchased_names(self, purchase_list: list) -> list:
+        """
+        Gets the names of the purchased stocks
+        :param purchase_list: purchase quantity for each stock
+        :type purchase_list: list
+        :return: names of the stocks with a positive quantity
+        :rtype: list
+        """
+        return [stock_name for stock_name, quantity in zip(self.names, purchase_list) if quantity]
+
 
 class CommonFunctions:
 
     DATASET_FILE = "test_datasets/dataset0.csv"
+    CSV_HEADERS = (['Action', 'Cout', 'Benefice'], ['name', 'price', 'profit'])
+    # Bytes of csv parsed at once by stream_csv_to_stocks
+    CHUNK_SIZE = 1 << 20
+    # Number of stocks from which dominated stocks are first searched on a price x gain grid, and grid size
+    DOMINANCE_BINS_MIN_SIZE = 10000
+    DOMINANCE_BINS = 256
 
     @staticmethod
     def csv_to_dict(file_path: str) -> dict:
         """
-        Transforms csv data into a dictionary
+        Transforms csv data into a dictionary. Both the Action,Cout,Benefice and the name,price,profit
+        headers are accepted, values are stored under the 'Cout' and 'Benefice' keys.
         :param file_path: path for the file to ve converted
         :type file_path: str
         :return: dictionary with csv file data
@@ -19,9 +116,517 @@ class CommonFunctions:
             reader = csv.DictReader(file)
             dict_stocks = {}
             for line in reader:
-                dict_stocks[line['Action']] = {'Cout': int(line['Cout']), 'Benefice': int(line['Benefice'])}
+                if 'Action' in line:
+                    dict_stocks[line['Action']] = {'Cout': int(line['Cout']), 'Benefice': int(line['Benefice'])}
+                else:
+                    # name,price,profit datasets hold 2-decimal float values
+                    dict_stocks[line['name']] = {'Cout': float(line['price']), 'Benefice': float(line['profit'])}
             return dict_stocks
 
+    @staticmethod
+    def csv_to_stocks(file_path: str) -> Stocks:
+        """
+        Transforms csv data into columnar stocks data. Both the Action,Cout,Benefice and the name,price,profit
+        headers are accepted, columns being read by position. Optional columns after them (sector, risk bucket...)
+        are kept as text in the stocks attributes, under their header name.
+        :param file_path: path for the file to be converted
+        :type file_path: str
+        :return: stocks names, prices, gain percentages and extra columns
+        :rtype: Stocks
+        """
+        with open(file_path, 'r', encoding='utf-8-sig', newline='') as file:
+            reader = csv.reader(file)
+            header = [column.strip() for column in next(reader)]
+            if header[:3] not in CommonFunctions.CSV_HEADERS:
+                raise ValueError(f"unknown stocks header in {file_path}: {header}")
+            names = []
+            costs = array('d')
+            profits = array('d')
+            extra_columns = [[] for _ in header[3:]]
+            for row in reader:
+                # Blank lines are skipped, like csv.DictReader does in csv_to_dict
+                if not any(field.strip() for field in row):
+                    continue
+                if len(row) < len(header):
+                    raise ValueError(
+                        f"{file_path} line {reader.line_num}: expected {len(header)} columns, got {len(row)}")
+                name, cost, profit, *extra = row
+                names.append(name)
+                costs.append(float(cost))
+                profits.append(float(profit))
+                for column, value in zip(extra_columns, extra):
+                    column.append(value.strip())
+        return Stocks(tuple(names), costs, profits,
+                      {column_name: tuple(column) for column_name, column in zip(header[3:], extra_columns)})
+
+    @staticmethod
+    def parse_floats(data, starts, ends):
+        """
+        Converts byte fields of a chunk into floats at once: the fields are gathered into a fixed width byte
+        strings array, padded with null bytes, which numpy converts without a python object per field
+        :param data: chunk bytes
+        :type data: numpy.ndarray
+        :param starts: offset of the first byte of each field
+        :type starts: numpy.ndarray
+        :param ends: offset after the last byte of each field
+        :type ends: numpy.ndarray
+        :return: field values
+        :rtype: numpy.ndarray
+        """
+        # Chunks are a few MB, int32 offsets halve the size of the gathered indexes
+        starts = starts.astype(np.int32)
+        lengths = (ends - starts).astype(np.int32)
+        width = max(1, int(lengths.max(initial=0)))
+        columns = np.arange(width, dtype=np.int32)
+        indexes = starts[:, None] + columns
+        np.minimum(indexes, len(data) - 1, out=indexes)
+        fields = np.where(columns < lengths[:, None], data[indexes], 0)
+        return fields.astype(np.uint8).view(f'S{width}').ravel().astype(np.float64)
+
+    @classmethod
+    def parse_chunk(cls, chunk: bytes, first_line: int, file_path: str) -> tuple:
+        """
+        Parses a chunk of name,price,profit lines with numpy: line breaks and commas are located on the bytes,
+        prices and gain percentages are converted by parse_floats and names are left in the chunk, so that only
+        the names of the kept rows are ever decoded. Blank lines are skipped.
+        :param chunk: csv lines, without the line break of the last one
+        :type chunk: bytes
+        :param first_line: line number of the first line of the chunk in the file
+        :type first_line: int
+        :param file_path: path of the file, for error messages
+        :type file_path: str
+        :return: start and end offset of each row name in the chunk, prices and gain percentages
+        :rtype: tuple
+        """
+        data = np.frombuffer(chunk, dtype=np.uint8)
+        line_breaks = np.flatnonzero(data == ord('\n'))
+        line_starts = np.concatenate(([0], line_breaks + 1))
+        line_ends = np.concatenate((line_breaks, [len(data)]))
+        # Windows line endings
+        line_ends -= (line_ends > line_starts) & (data[np.maximum(line_ends - 1, 0)] == ord('\r'))
+
+        commas = np.flatnonzero(data == ord(','))
+        first_commas = np.searchsorted(commas, line_starts)
+        comma_counts = np.searchsorted(commas, line_ends) - first_commas
+        # Blank lines hold no comma, the few lines without a comma are checked one by one
+        rows = np.ones(len(line_starts), dtype=bool)
+        for line in np.flatnonzero(comma_counts == 0).tolist():
+            rows[line] = bool(chunk[line_starts[line]:line_ends[line]].strip())
+        rows = np.flatnonzero(rows)
+        line_starts, line_ends = line_starts[rows], line_ends[rows]
+        first_commas, comma_counts = first_commas[rows], comma_counts[rows]
+        wrong_rows = np.flatnonzero(comma_counts != 2)
+        if len(wrong_rows):
+            raise ValueError(f"{file_path} line {first_line + int(rows[wrong_rows[0]])}: expected 3 columns, "
+                             f"got {int(comma_counts[wrong_rows[0]]) + 1}")
+        name_ends = commas[first_commas]
+        profit_starts = commas[first_commas + 1] + 1
+        return (line_starts, name_ends, cls.parse_floats(data, name_ends + 1, profit_starts - 1),
+                cls.parse_floats(data, profit_starts, line_ends))
+
+    @staticmethod
+    def parse_chunk_text(chunk: bytes, first_line: int, file_path: str) -> tuple:
+        """
+        Pure python version of parse_chunk, names being decoded for every row
+        :param chunk: csv lines, without the line break of the last one
+        :type chunk: bytes
+        :param first_line: line number of the first line of the chunk in the file
+        :type first_line: int
+        :param file_path: path of the file, for error messages
+        :type file_path: str
+        :return: names, prices and gain percentages
+        :rtype: tuple
+        """
+        names = []
+        costs = []
+        profits = []
+        for line_number, line in enumerate(chunk.decode('utf-8').split('\n'), first_line):
+            if not line.strip():
+                continue
+            fields = line.rstrip('\r').split(',')
+            if len(fields) != 3:
+                raise ValueError(f"{file_path} line {line_number}: expected 3 columns, got {len(fields)}")
+            names.append(fields[0])
+            costs.append(float(fields[1]))
+            profits.append(float(fields[2]))
+        return names, costs, profits
+
+    @staticmethod
+    def filter_chunk(costs: list, profits: list, purchase_limit: float, report: dict) -> list:
+        """
+        Finds the stocks of a chunk worth buying: positive price and gain percentage, price within the purchase limit
+        :param costs: prices of the chunk
+        :type costs: list
+        :param profits: gain percentages of the chunk
+        :type profits: list
+        :param purchase_limit: maximum amount to be expended in stock purchases, no price filter if None
+        :type purchase_limit: float
+        :param report: number of stocks removed by each rule, updated with the chunk
+        :type report: dict
+        :return: positions of the kept stocks in the chunk
+        :rtype: list
+        """
+        if np is not None:
+            positive_cost = costs > 0
+            positive_profit = positive_cost & (profits > 0)
+            in_budget = positive_profit if purchase_limit is None else positive_profit & (costs <= purchase_limit)
+            counts = [int(np.count_nonzero(mask)) for mask in (positive_cost, positive_profit, in_budget)]
+            kept = np.flatnonzero(in_budget)
+        else:
+            positive_cost = [cost > 0 for cost in costs]
+            positive_profit = [profit > 0 for profit in compress(profits, positive_cost)]
+            kept = [
+                position for position, (cost, profit) in enumerate(zip(costs, profits))
+                if cost > 0 and profit > 0 and (purchase_limit is None or cost <= purchase_limit)
+            ]
+            counts = [sum(positive_cost), sum(positive_profit), len(kept)]
+        report['rows'] += len(costs)
+        report['non_positive_cost'] += len(costs) - counts[0]
+        report['non_positive_profit'] += counts[0] - counts[1]
+        report['over_budget'] += counts[1] - counts[2]
+        return kept
+
+    def stream_csv_to_stocks(
+            self, file_path: str, purchase_limit: float = None, prune_dominated: bool = True, chunk_size: int = None
+    ) -> tuple:
+        """
+        Loads a csv file chunk by chunk from a memory map straight into typed arrays, filtering the stocks as they
+        are read (see filter_chunk) so that only the remaining stocks are held in memory. With a purchase limit,
+        the dominated stocks are pruned after each chunk among the stocks kept so far and the chunk ones: their
+        dominating stocks are part of all the stocks, so each removal stays safe (see find_dominated_stocks).
+        Only the names of the kept rows are decoded. Rows must be unquoted name,price,profit or Action,Cout,Benefice
+        lines, blank lines are skipped.
+        :param file_path: path for the file to be loaded
+        :type file_path: str
+        :param purchase_limit: maximum amount to be expended in stock purchases, no price filter if None
+        :type purchase_limit: float
+        :param prune_dominated: also removes the dominated stocks, needs a purchase limit
+        :type prune_dominated: bool
+        :param chunk_size: bytes parsed at once, CHUNK_SIZE if not declared
+        :type chunk_size: int
+        :return: remaining stocks and number of rows read and removed by each rule
+        :rtype: tuple
+        """
+        chunk_size = chunk_size if chunk_size else self.CHUNK_SIZE
+        prune_dominated = prune_dominated and purchase_limit is not None
+        report = {'rows': 0, 'non_positive_cost': 0, 'non_positive_profit': 0, 'over_budget': 0, 'dominated': 0}
+        names = []
+        costs = array('d')
+        profits = array('d')
+        with open(file_path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                raise ValueError(f"empty stocks file: {file_path}")
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                size = len(mapped)
+                header_end = mapped.find(b'\n')
+                header_end = size if header_end == -1 else header_end
+                header = mapped[:header_end].decode('utf-8-sig').strip().split(',')
+                if [column.strip() for column in header] not in self.CSV_HEADERS:
+                    raise ValueError(f"unknown stocks header in {file_path}: {header}")
+
+                position = header_end + 1
+                line_number = 2
+                # Running price x gain grid of all the stocks read so far, see find_dominated_on_grid
+                grid = None
+                scales = None
+                while position < size:
+                    # Chunks end on a line break, a line longer than chunk_size makes a longer chunk
+                    end = mapped.rfind(b'\n', position, position + chunk_size)
+                    if end == -1 or position + chunk_size >= size:
+                        end = mapped.find(b'\n', position + chunk_size) if position + chunk_size < size else -1
+                        end = size if end == -1 else end
+                    chunk = mapped[position:end]
+                    if hasattr(mmap, 'MADV_DONTNEED'):
+                        # The pages read are released, so that the resident size does not grow with the file
+                        page_start = position - position % mmap.PAGESIZE
+                        mapped.madvise(mmap.MADV_DONTNEED, page_start, end - page_start)
+                    position = end + 1
+                    if np is not None:
+                        name_starts, name_ends, chunk_costs, chunk_profits = self.parse_chunk(
+                            chunk, line_number, file_path)
+                    else:
+                        chunk_names, chunk_costs, chunk_profits = self.parse_chunk_text(chunk, line_number, file_path)
+                    line_number += chunk.count(b'\n') + 1
+                    kept = self.filter_chunk(chunk_costs, chunk_profits, purchase_limit, report)
+                    if np is not None:
+                        kept_costs = chunk_costs[kept]
+                        kept_profits = chunk_profits[kept]
+                        if prune_dominated and len(kept):
+                            kept_gains = kept_costs * kept_profits
+                            if grid is None:
+                                scales = self.dominance_scales(kept_costs, kept_gains)
+                                grid = np.zeros((self.DOMINANCE_BINS, self.DOMINANCE_BINS))
+                            self.add_to_dominance_grid(grid, scales, kept_costs, kept_gains)
+                            # The stocks kept from the previous chunks may be dominated by the ones of this chunk
+                            previous_costs = np.array(costs)
+                            previous_profits = np.array(profits)
+                            previous_gains = previous_costs * previous_profits
+                            previous_kept = ~self.find_dominated_on_grid(
+                                grid, scales, previous_costs, previous_gains, purchase_limit)
+                            chunk_kept = ~self.find_dominated_on_grid(
+                                grid, scales, kept_costs, kept_gains, purchase_limit)
+                            report['dominated'] += len(previous_kept) + len(chunk_kept) - int(
+                                np.count_nonzero(previous_kept)) - int(np.count_nonzero(chunk_kept))
+                            names = list(compress(names, previous_kept.tolist()))
+                            costs = array('d', previous_costs[previous_kept].tobytes())
+                            profits = array('d', previous_profits[previous_kept].tobytes())
+                            kept = kept[chunk_kept]
+                            kept_costs = kept_costs[chunk_kept]
+                            kept_profits = kept_profits[chunk_kept]
+                        costs.frombytes(kept_costs.tobytes())
+                        profits.frombytes(kept_profits.tobytes())
+                        names.extend(chunk[name_start:name_end].decode('utf-8') for name_start, name_end in
+                                     zip(name_starts[kept].tolist(), name_ends[kept].tolist()))
+                        continue
+
+                    kept_costs = [chunk_costs[index] for index in kept]
+                    kept_profits = [chunk_profits[index] for index in kept]
+                    kept_names = [chunk_names[index] for index in kept]
+                    if prune_dominated and kept:
+                        # Without numpy the exact sweep runs on the stocks kept so far and the chunk ones
+                        all_costs = costs.tolist() + kept_costs
+                        all_profits = profits.tolist() + kept_profits
+                        dominated = set(self.find_dominated_stocks(
+                            all_costs, list(map(mul, all_costs, all_profits)), purchase_limit))
+                        report['dominated'] += len(dominated)
+                        remaining = [index for index in range(len(all_costs)) if index not in dominated]
+                        all_names = names + kept_names
+                        names = [all_names[index] for index in remaining]
+                        costs = array('d', (all_costs[index] for index in remaining))
+                        profits = array('d', (all_profits[index] for index in remaining))
+                    else:
+                        names.extend(kept_names)
+                        costs.extend(kept_costs)
+                        profits.extend(kept_profits)
+
+        stocks = Stocks(tuple(names), costs, profits)
+        if prune_dominated and np is not None:
+            # The grid only sums part of the dominating stocks, the exact sweep ends the pruning on the remaining ones
+            dominated = set(self.find_dominated_stocks(stocks.costs, stocks.gains, purchase_limit))
+            report['dominated'] += len(dominated)
+            if dominated:
+                stocks = stocks.select([position for position in range(len(stocks)) if position not in dominated])
+        return stocks, report
+
+    @classmethod
+    def dominance_scales(cls, costs, gains) -> tuple:
+        """
+        Gets the DOMINANCE_BINS price bins and gain bins of a price x gain grid, evenly spread between the lowest
+        and the highest values. Values out of that range fall in the first or the last bin.
+        :param costs: stock prices
+        :type costs: numpy.ndarray
+        :param gains: stock gains
+        :type gains: numpy.ndarray
+        :return: (lowest value, bins per unit) of prices and of gains
+        :rtype: tuple
+        """
+        return tuple(
+            (float(values.min()), cls.DOMINANCE_BINS / float(values.max() - values.min()) if values.max() > values.min()
+             else 0.0) for values in (costs, gains)
+        )
+
+    @classmethod
+    def dominance_bins(cls, scales: tuple, costs, gains) -> tuple:
+        """
+        Gets the price bin and the gain bin of stocks. Bins are computed instead of searched, a higher bin always
+        holding higher values.
+        :param scales: price and gain scales, see dominance_scales
+        :type scales: tuple
+        :param costs: stock prices
+        :type costs: numpy.ndarray
+        :param gains: stock gains
+        :type gains: numpy.ndarray
+        :return: price bins and gain bins
+        :rtype: tuple
+        """
+        return tuple(np.clip(((values - low) * factor).astype(np.int64), 0, cls.DOMINANCE_BINS - 1)
+                     for values, (low, factor) in zip((costs, gains), scales))
+
+    @classmethod
+    def add_to_dominance_grid(cls, grid, scales: tuple, costs, gains):
+        """
+        Adds the prices of stocks to a price x gain grid
+        :param grid: price sums by price bin and gain bin, updated in place
+        :type grid: numpy.ndarray
+        :param scales: price and gain scales, see dominance_scales
+        :type scales: tuple
+        :param costs: stock prices
+        :type costs: numpy.ndarray
+        :param gains: stock gains
+        :type gains: numpy.ndarray
+        """
+        bins = cls.DOMINANCE_BINS
+        cost_bins, gain_bins = cls.dominance_bins(scales, costs, gains)
+        grid += np.bincount(cost_bins * bins + gain_bins, weights=costs, minlength=bins * bins).reshape(bins, bins)
+
+    @classmethod
+    def find_dominated_on_grid(cls, grid, scales: tuple, costs, gains, purchase_limit: float):
+        """
+        Finds dominated stocks on a price x gain grid: the stocks of cheaper price bins and more profitable gain
+        bins all dominate a stock, their total price is read from cumulative sums of the grid. Only part of the
+        dominating stocks are summed, so it removes fewer stocks than the exact sweep, but each removal is as safe.
+        :param grid: price sums by price bin and gain bin, see add_to_dominance_grid
+        :type grid: numpy.ndarray
+        :param scales: price and gain scales, see dominance_scales
+        :type scales: tuple
+        :param costs: prices of the stocks to check
+        :type costs: numpy.ndarray
+        :param gains: gains of the stocks to check
+        :type gains: numpy.ndarray
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: float
+        :return: boolean mask of the dominated stocks
+        :rtype: numpy.ndarray
+        """
+        cost_bins, gain_bins = cls.dominance_bins(scales, costs, gains)
+        # Price of the stocks in strictly cheaper bins, then in strictly more profitable bins among them
+        cheaper = np.cumsum(grid, axis=0) - grid
+        dominating = np.cumsum(cheaper[:, ::-1], axis=1)[:, ::-1] - cheaper
+        return dominating[cost_bins, gain_bins] + costs > purchase_limit + 1e-9
+
+    @classmethod
+    def find_dominated_by_bins(cls, costs: list, gains: list, purchase_limit: float):
+        """
+        Vectorized first pass of find_dominated_stocks for large inputs, on a price x gain grid of the stocks
+        (see find_dominated_on_grid). The pass is O(n).
+        :param costs: stock prices, all positive
+        :type costs: list
+        :param gains: stock gains, all positive
+        :type gains: list
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: float
+        :return: boolean mask of the dominated stocks
+        :rtype: numpy.ndarray
+        """
+        cost_values = np.asarray(costs, dtype=np.float64)
+        gain_values = np.asarray(gains, dtype=np.float64)
+        scales = cls.dominance_scales(cost_values, gain_values)
+        grid = np.zeros((cls.DOMINANCE_BINS, cls.DOMINANCE_BINS))
+        cls.add_to_dominance_grid(grid, scales, cost_values, gain_values)
+        return cls.find_dominated_on_grid(grid, scales, cost_values, gain_values, purchase_limit)
+
+    @classmethod
+    def find_dominated_stocks(cls, costs: list, gains: list, purchase_limit: float, max_positions: int = None) -> list:
+        """
+        Finds the stocks that can be removed because other stocks beat them on both price and gain. A dominated
+        stock is only removed when it cannot be bought together with all its dominating stocks, for lack of budget
+        or of positions: an optimal purchase list holding it then misses one of them, which can replace it for a
+        lower price and a higher gain.
+        Stocks are swept by increasing price while a Fenwick tree over gain ranks sums the prices of the stocks
+        seen so far, so the search is O(n log n). Over DOMINANCE_BINS_MIN_SIZE stocks, find_dominated_by_bins
+        removes most of them first when numpy is installed.
+        :param costs: stock prices, all positive
+        :type costs: list
+        :param gains: stock gains, all positive
+        :type gains: list
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: float
+        :param max_positions: maximum number of purchased stocks, no limit if not declared
+        :type max_positions: int
+        :return: positions of the dominated stocks
+        :rtype: list
+        """
+        positions = range(len(costs))
+        dominated = []
+        if np is not None and len(costs) > cls.DOMINANCE_BINS_MIN_SIZE:
+            dominated_mask = cls.find_dominated_by_bins(costs, gains, purchase_limit)
+            dominated = np.flatnonzero(dominated_mask).tolist()
+            positions = np.flatnonzero(~dominated_mask).tolist()
+
+        # Equal stocks are ordered by position so that only the first one dominates the others
+        order = sorted(positions, key=lambda position: (costs[position], -gains[position], position))
+        # Negated distinct gains, rank r covers all gains greater than or equal to the r-th highest gain
+        distinct_gains = sorted({-gains[position] for position in positions})
+        tree = [0.0] * (len(distinct_gains) + 1)
+        tree_size = len(tree)
+        # Number of stocks seen so far by gain rank, only with a maximum number of positions
+        count_tree = [0] * tree_size if max_positions is not None else None
+        for position in order:
+            cost = costs[position]
+            rank = bisect_left(distinct_gains, -gains[position]) + 1
+
+            # Total price of the stocks at most as expensive and at least as profitable
+            dominating_cost = 0.0
+            index = rank
+            while index:
+                dominating_cost += tree[index]
+                index &= index - 1
+            if dominating_cost + cost > purchase_limit + 1e-9:
+                dominated.append(position)
+            elif count_tree is not None:
+                dominating_count = 0
+                index = rank
+                while index:
+                    dominating_count += count_tree[index]
+                    index &= index - 1
+                if dominating_count >= max_positions:
+                    dominated.append(position)
+
+            # Dominated stocks still dominate the next ones through transitivity
+            index = rank
+            while index < tree_size:
+                tree[index] += cost
+                if count_tree is not None:
+                    count_tree[index] += 1
+                index += index & -index
+        return sorted(dominated)
+
+    def sanitize_stocks(self, stocks: Stocks, purchase_limit: float) -> tuple:
+        """
+        Filters the stocks that cannot be part of a best purchase list before solving: non positive price,
+        non positive gain, price over the purchase limit and dominated stocks (see find_dominated_stocks)
+        :param stocks: all stock data
+        :type stocks: Stocks
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: float
+        :return: remaining stocks and number of stocks removed by each rule
+        :rtype: tuple
+        """
+        if np is not None:
+            costs = np.frombuffer(stocks.costs)
+            profits = np.frombuffer(stocks.profits)
+            positive_cost = costs > 0
+            positive_profit = positive_cost & (profits > 0)
+            in_budget = positive_profit & (costs <= purchase_limit)
+            report = {
+                'non_positive_cost': int(len(stocks) - np.count_nonzero(positive_cost)),
+                'non_positive_profit': int(np.count_nonzero(positive_cost) - np.count_nonzero(positive_profit)),
+                'over_budget': int(np.count_nonzero(positive_profit) - np.count_nonzero(in_budget))
+            }
+            positions = np.flatnonzero(in_budget).tolist()
+        else:
+            report = {'non_positive_cost': 0, 'non_positive_profit': 0, 'over_budget': 0}
+            positions = []
+            for position, (cost, profit) in enumerate(zip(stocks.costs, stocks.profits)):
+                if cost <= 0:
+                    report['non_positive_cost'] += 1
+                elif profit <= 0:
+                    report['non_positive_profit'] += 1
+                elif cost > purchase_limit:
+                    report['over_budget'] += 1
+                else:
+                    positions.append(position)
+
+        costs = [stocks.costs[position] for position in positions]
+        gains = [stocks.gains[position] for position in positions]
+        dominated = set(self.find_dominated_stocks(costs, gains, purchase_limit))
+        report['dominated'] = len(dominated)
+        positions = [position for index, position in enumerate(positions) if index not in dominated]
+        return stocks.select(positions), report
+
+    @staticmethod
+    def get_peak_memory() -> float:
+        """
+        Gets the peak resident set size of the current process
+        :return: peak RSS in MB, 0 when it cannot be measured on this platform
+        :rtype: float
+        """
+        if resource is None:
+            return 0
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+        return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
     @staticmethod
     def stock_dict_to_stock_name_list(stock_dict: dict) -> list:
         """
@@ -164,84 +769,126 @@ class BruteForceCalculation:
 
     def brute_force_calculation(
             self,
-            purchase_limit: int,
+            purchase_limit: float,
             stock_index: int,
-            stock_names_list: list,
-            stocks_dict: dict,
+            stocks: Stocks,
             purchase_list: list = None,
-            best_list: list = None
+            best_list: list = None,
+            stats: SolveStats = None,
+            max_quantities: list = None
     ):
         """
         Calculates the best purchase option for a given limit and a given list of stock prices and expected gains
         :param best_list: takes into account the last bast_list found so far. Empty if not declared.
         :type best_list: list
         :param purchase_limit: maximum amount to be expended in stock purchases
-        :type purchase_limit: int
+        :type purchase_limit: float
         :param stock_index: stock position for which we try all purchase options
         :type stock_index: int
-        :param stock_names_list: all stock names
-        :type stock_names_list: list
-        :param stocks_dict: all stock data
-        :type stocks_dict: dict
+        :param stocks: all stock data
+        :type stocks: Stocks
         :param purchase_list: ongoing list of purchases
         :type purchase_list: list
-        :return: nothing
-        :rtype:
+        :param stats: counts the calls as nodes explored, once the search is over
+        :type stats: SolveStats
+        :param max_quantities: maximum quantity of each stock, 1 if not declared
+        :type max_quantities: list
+        :return: best purchase list
+        :rtype: list
+        """
+        explored = [0] if stats is not None else None
+        best_list = self.brute_force_search(
+            purchase_limit, stock_index, stocks, purchase_list, best_list, max_quantities, explored
+        )
+        if stats is not None:
+            stats.count('nodes_explored', explored[0])
+        return best_list
+
+    def brute_force_search(
+            self,
+            purchase_limit: float,
+            stock_index: int,
+            stocks: Stocks,
+            purchase_list: list,
+            best_list: list,
+            max_quantities: list,
+            explored: list
+    ):
+        """
+        Recursive search of brute_force_calculation, the calls are counted in a local counter rather than in the
+        solve statistics
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: float
+        :param stock_index: stock position for which we try all purchase options
+        :type stock_index: int
+        :param stocks: all stock data
+        :type stocks: Stocks
+        :param purchase_list: ongoing list of purchases, None to start from no purchase
+        :type purchase_list: list
+        :param best_list: best purchase list found so far, None if there is none yet
+        :type best_list: list
+        :param max_quantities: maximum quantity of each stock, 1 if None
+        :type max_quantities: list
+        :param explored: single item list counting the calls, None to not count them
+        :type explored: list
+        :return: best purchase list
+        :rtype: list
         """
+        if explored is not None:
+            explored[0] += 1
+
         # Declaration of best list variable that will stock the best solution found by the algo
         # Empty list if not provided
-        best_list = best_list if best_list else [0] * 20
+        best_list = best_list if best_list else [0] * len(stocks)
 
-        purchase_list = purchase_list if purchase_list else [0] * 20
+        purchase_list = purchase_list if purchase_list else [0] * len(stocks)
 
         # Declaration of the remaining limit value
-        remaining_limit = self.common_functions.calculate_remaining_limit(
-                    purchase_limit, purchase_list, stock_names_list, stocks_dict)
-
-        # Save stock name and value for a given iteration
-        stock_name = self.common_functions.get_stock_name(stock_index, stock_names_list)
-        stock_price = self.common_functions.get_stock_price(stock_name, stocks_dict)
-
-        # We test all purchases quantity options possible in the remaining purchase limit
-        for purchase_quantity in range(0, min(int(remaining_limit/stock_price + 1), 2)):
+        remaining_limit = purchase_limit - stocks.total_cost(purchase_list)
+
+        # Save stock value for a given iteration
+        stock_price = stocks.costs[stock_index]
+
+        # Stocks with a negative price further on give budget back, a purchase may go over the limit before them
+        refund = -sum(min(cost, 0) * (max_quantities[index] if max_quantities else 1)
+                      for index, cost in enumerate(stocks.costs[stock_index + 1:], stock_index + 1))
+
+        # We test all purchases quantity options possible in the remaining purchase limit, any quantity of a stock
+        # with a non positive price, and always quantity 0 so that the next stocks are tested
+        max_quantity = max_quantities[stock_index] if max_quantities else 1
+        quantity_end = max_quantity + 1
+        if stock_price > 0:
+            quantity_end = max(1, min(int((remaining_limit + refund) / stock_price + 1), quantity_end))
+        for purchase_quantity in range(0, quantity_end):
             # We update the purchases quantity in the purchase list position of the given stock
             purchase_list[stock_index] = purchase_quantity
 
             # We update the remaining limit based on the ongoing quantity purchase test
-            remaining_limit = self.common_functions.calculate_remaining_limit(
-                purchase_limit, purchase_list, stock_names_list, stocks_dict)
+            remaining_limit = purchase_limit - stocks.total_cost(purchase_list)
 
             # Calculate best gain seen so far
-            best_gain = self.common_functions.calculate_total_gain(
-                stock_names_list=stock_names_list,
-                stocks_dict=stocks_dict,
-                purchase_list=best_list
-            )
+            best_gain = stocks.total_gain(best_list)
 
             # Calculate current gain
-            current_gain = self.common_functions.calculate_total_gain(
-                purchase_list=purchase_list,
-                stock_names_list=stock_names_list,
-                stocks_dict=stocks_dict
-            )
+            current_gain = stocks.total_gain(purchase_list)
 
-            # If the current gain is better than the best found so far, we update
+            # If the current gain is better than the best found so far and within the purchase limit, we update
             # the best purchase list with the ongoing purchase test
-            if current_gain > best_gain:
+            if current_gain > best_gain and remaining_limit >= -1e-9:
                 best_list = purchase_list.copy()
 
             # if we are not at then end of the list of stocks we recursively call the function
-            if stock_index < len(stock_names_list) - 1:
-                new_best_list = self.brute_force_calculation(
+            if stock_index < len(stocks) - 1:
+                new_best_list = self.brute_force_search(
                     purchase_limit=purchase_limit,
                     stock_index=stock_index + 1,
-                    stock_names_list=stock_names_list,
+                    stocks=stocks,
                     purchase_list=purchase_list,
-                    stocks_dict=stocks_dict,
-                    best_list=best_list
+                    best_list=best_list,
+                    max_quantities=max_quantities,
+                    explored=explored
                 )
-                new_best_gain = self.common_functions.calculate_total_gain(
-                    purchase_list=new_best_list, stock_names_list=stock_names_list, stocks_dict=stocks_dict)
+                new_best_gain = stocks.total_gain(new_best_list)
                 if new_best_gain > best_gain:
                     best_list = new_best_list.copy()
             # print(best_list)
@@ -260,12 +907,14 @@ class BruteForceCalculation:
 def main():
     common_functions = CommonFunctions()
     brute_force_calculation = BruteForceCalculation(common_functions)
-    dict_stocks = common_functions.csv_to_dict(common_functions.DATASET_FILE)
-    stock_names_list = common_functions.stock_dict_to_stock_name_list(dict_stocks)
-    best_list = brute_force_calculation.brute_force_calculation(500, 0, stock_names_list, dict_stocks)
-    print(best_list)
-    print(stock_names_list)
-    # print(common_functions.get_price_dict(dict_stocks))
+    stats = SolveStats()
+    with measure_phase(stats, 'load'):
+        stocks = common_functions.csv_to_stocks(common_functions.DATASET_FILE)
+    with measure_phase(stats, 'solve'):
+        best_list = brute_force_calculation.brute_force_calculation(500, 0, stocks, stats=stats)
+    logger.debug("best list: %s", best_list)
+    print(stocks.purchased_names(best_list))
+    print(stats.as_dict())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import sqlite3
+import sys
+import time
+
+from array import array
+from collections import OrderedDict
+
+from bruteforce import Stocks
+from instrumentation import SolveStats
+
+
+class SolveCache:
+    """
+    Cache of solved purchase lists keyed by the stocks content, the purchase limit and the solver settings:
+    an in-memory LRU layer in front of an sqlite file capped in size
+    """
+
+    DEFAULT_PATH = "solve_cache.sqlite3"
+
+    def __init__(self, path: str = None, memory_size: int = 128, disk_size_limit: int = 64 * 1024 * 1024):
+        """
+        :param path: sqlite file of the disk layer, memory layer only if not declared
+        :type path: str
+        :param memory_size: number of results kept in memory
+        :type memory_size: int
+        :param disk_size_limit: bytes of stored results over which the least recently used ones are evicted
+        :type disk_size_limit: int
+        """
+        self.memory_size = memory_size
+        self.disk_size_limit = disk_size_limit
+        self.memory = OrderedDict()
+        # Access times of the memory hits, written to the disk layer before it evicts results
+        self.touched = {}
+        self.hits = 0
+        self.misses = 0
+        self.connection = None
+        if path:
+            self.connection = sqlite3.connect(path)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS results "
+                "(key TEXT PRIMARY KEY, purchase_list TEXT, gain REAL, size INTEGER, last_access REAL)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS results_access ON results (last_access)")
+            self.connection.commit()
+
+    @staticmethod
+    def make_key(stocks: Stocks, purchase_limit: float, settings: dict = None) -> str:
+        """
+        Hashes the normalized stock arrays with the purchase limit and solver settings
+        :param stocks: all stock data
+        :type stocks: Stocks
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: float
+        :param settings: solver name and options, anything changing the result
+        :type settings: dict
+        :return: hexadecimal sha256 digest
+        :rtype: str
+        """
+        digest = hashlib.sha256()
+        # Prices and gain percentages as little endian float64, whatever the platform
+        for column in (stocks.costs, stocks.profits):
+            values = array('d', column)
+            if sys.byteorder == 'big':
+                values.byteswap()
+            digest.update(values.tobytes())
+        digest.update(json.dumps([len(stocks), float(purchase_limit), settings or {}], sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        """
+        Gets a stored result, from memory first then from disk
+        :param key: key returned by make_key
+        :type key: str
+        :return: (purchase list, gain), None if the result is not stored
+        :rtype: tuple
+        """
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            if self.connection is not None:
+                self.touched[key] = time.time()
+            self.hits += 1
+            return self.memory[key]
+        if self.connection is not None:
+            row = self.connection.execute(
+                "SELECT purchase_list, gain FROM results WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.connection.execute("UPDATE results SET last_access = ? WHERE key = ?", (time.time(), key))
+                self.connection.commit()
+                result = (json.loads(row[0]), row[1])
+                self.store_in_memory(key, result)
+                self.hits += 1
+                return result
+        self.misses += 1
+        return None
+
+    def put(self, key: str, purchase_list: list, gain: float):
+        """
+        Stores a result in memory and on disk, evicting the least recently used results over the limits
+        :param key: key returned by make_key
+        :type key: str
+        :param purchase_list: purchase list to be stored
+        :type purchase_list: list
+        :param gain: gain of the purchase list
+        :type gain: float
+        """
+        self.store_in_memory(key, (list(purchase_list), gain))
+        if self.connection is None:
+            return
+        serialized = json.dumps(list(purchase_list), separators=(',', ':'))
+        self.connection.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+            (key, serialized, gain, len(serialized), time.time())
+        )
+        self.flush_touched()
+        total_size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        while total_size > self.disk_size_limit:
+            oldest = self.connection.execute(
+                "SELECT key, size FROM results ORDER BY last_access LIMIT 1").fetchone()
+            if oldest is None or oldest[0] == key:
+                break
+            self.connection.execute("DELETE FROM results WHERE key = ?", (oldest[0],))
+            total_size -= oldest[1]
+        self.connection.commit()
+
+    def flush_touched(self):
+        """
+        Writes the access times of the memory hits to the disk layer, so that its eviction keeps the results
+        used from memory
+        """
+        if self.connection is not None and self.touched:
+            self.connection.executemany(
+                "UPDATE results SET last_access = ? WHERE key = ?",
+                [(access_time, key) for key, access_time in self.touched.items()]
+            )
+            self.connection.commit()
+        self.touched.clear()
+
+    def store_in_memory(self, key: str, result: tuple):
+        """
+        Stores a result in the LRU memory layer
+        :param key: key returned by make_key
+        :type key: str
+        :param result: (purchase list, gain)
+        :type result: tuple
+        """
+        self.memory[key] = result
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def cached_calculation(
+            self, solver, purchase_limit: float, stocks: Stocks, settings: dict, stats: SolveStats = None
+    ) -> tuple:
+        """
+        Returns the stored purchase list and gain of the problem, calling the solver only on a cache miss
+        :param solver: function(purchase_limit, stocks) returning a purchase list
+        :type solver: callable
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: float
+        :param stocks: all stock data
+        :type stocks: Stocks
+        :param settings: solver name and options, part of the key
+        :type settings: dict
+        :param stats: counts the cache hits and misses
+        :type stats: SolveStats
+        :return: best purchase list and its gain
+        :rtype: tuple
+        """
+        key = self.make_key(stocks, purchase_limit, settings)
+        result = self.get(key)
+        if stats is not None:
+            stats.count('cache_misses' if result is None else 'cache_hits')
+        if result is not None:
+            return list(result[0]), result[1]
+        purchase_list = solver(purchase_limit, stocks)
+        gain = stocks.total_gain(purchase_list)
+        self.put(key, purchase_list, gain)
+        return purchase_list, gain
+
+    def close(self):
+        if self.connection is not None:
+            self.flush_touched()
+            self.connection.close()
+            self.connection = None
@@ -0,0 +1,151 @@
+from array import array
+
+from bruteforce import Stocks
+
+
+# Gain difference under which two purchase lists are equally good, relative to gains above 1, gains being sums of
+# float products
+GAIN_TOLERANCE = 1e-6
+
+
+def gains_agree(gain: float, reference_gain: float) -> bool:
+    """
+    Checks that two gains are equal within GAIN_TOLERANCE
+    :param gain: gain of a purchase list
+    :type gain: float
+    :param reference_gain: gain of the reference purchase list
+    :type reference_gain: float
+    :return: whether the gains agree
+    :rtype: bool
+    """
+    return abs(gain - reference_gain) <= GAIN_TOLERANCE * max(1.0, abs(reference_gain))
+
+
+class Certificate:
+    """
+    Gain of a purchase list with the LP relaxation upper bound of the instance: the purchase list is at most
+    gap away from the optimum, whichever solver produced it
+    """
+    __slots__ = ('gain', 'upper_bound', 'feasible')
+
+    def __init__(self, gain: float, upper_bound: float, feasible: bool):
+        self.gain = gain
+        self.upper_bound = upper_bound
+        self.feasible = feasible
+
+    @property
+    def gap(self) -> float:
+        """
+        Relative gap between the gain and the upper bound, 0 when the bound is reached
+        :return: (upper bound - gain) / upper bound
+        :rtype: float
+        """
+        if self.upper_bound <= 0:
+            return 0.0
+        return max(0.0, (self.upper_bound - self.gain) / self.upper_bound)
+
+    def __repr__(self):
+        return f"Certificate(gain={self.gain}, upper_bound={self.upper_bound}, feasible={self.feasible})"
+
+
+def to_positive_prices(purchase_limit: float, stocks: Stocks) -> tuple:
+    """
+    Rewrites an instance into one with positive prices and gains only. A stock with a non positive price and
+    a non negative gain is always bought, a stock with a non negative price and a non positive gain never is.
+    A stock with a negative price and a negative gain is bought first: giving it up then costs its opposite
+    price for its opposite gain, a stock like any other.
+    :param purchase_limit: maximum amount to be expended in stock purchases
+    :type purchase_limit: float
+    :param stocks: all stock data
+    :type stocks: Stocks
+    :return: positive stocks, their purchase limit, purchase list of the stocks bought first, position of
+    each positive stock in stocks and whether it is given up instead of bought
+    :rtype: tuple
+    """
+    base_list = [0] * len(stocks)
+    positions = []
+    flipped = []
+    positive_limit = purchase_limit
+    for position, (cost, gain) in enumerate(zip(stocks.costs, stocks.gains)):
+        if cost <= 0 and gain >= 0:
+            base_list[position] = 1
+            positive_limit -= cost
+        elif cost < 0:
+            base_list[position] = 1
+            positive_limit -= cost
+            positions.append(position)
+            flipped.append(True)
+        elif gain > 0:
+            positions.append(position)
+            flipped.append(False)
+    # Giving up a stock keeps its gain percentage: -gain / -cost
+    positive_stocks = Stocks(
+        tuple(stocks.names[position] for position in positions),
+        array('d', (abs(stocks.costs[position]) for position in positions)),
+        array('d', (stocks.profits[position] for position in positions))
+    )
+    return positive_stocks, positive_limit, base_list, positions, flipped
+
+
+def from_positive_prices(positive_list: list, base_list: list, positions: list, flipped: list) -> list:
+    """
+    Gets the purchase list of an instance from the purchase list of its positive instance
+    :param positive_list: purchase list of the positive stocks
+    :type positive_list: list
+    :param base_list: purchase list of the stocks bought first, returned by to_positive_prices
+    :type base_list: list
+    :param positions: position of each positive stock, returned by to_positive_prices
+    :type positions: list
+    :param flipped: whether each positive stock is given up instead of bought, returned by to_positive_prices
+    :type flipped: list
+    :return: purchase list of the instance
+    :rtype: list
+    """
+    purchase_list = base_list.copy()
+    for position, given_up, quantity in zip(positions, flipped, positive_list):
+        purchase_list[position] = 1 - quantity if given_up else quantity
+    return purchase_list
+
+
+def lp_upper_bound(purchase_limit: float, stocks: Stocks) -> float:
+    """
+    Gets the LP relaxation upper bound of the best gain, each stock being bought in a fraction between 0 and 1:
+    on the positive instance, the stocks are bought by decreasing gain percentage and the first one not
+    fitting is bought in the fraction that fits. Runs in O(n log n).
+    :param purchase_limit: maximum amount to be expended in stock purchases
+    :type purchase_limit: float
+    :param stocks: all stock data
+    :type stocks: Stocks
+    :return: upper bound of the gain of any purchase list within the limit, -inf if none is
+    :rtype: float
+    """
+    positive_stocks, remaining_limit, base_list, _, _ = to_positive_prices(purchase_limit, stocks)
+    if remaining_limit < -GAIN_TOLERANCE:
+        return float('-inf')
+    bound = stocks.total_gain(base_list)
+    for position in sorted(range(len(positive_stocks)), key=positive_stocks.profits.__getitem__, reverse=True):
+        cost = positive_stocks.costs[position]
+        if cost > remaining_limit:
+            return bound + positive_stocks.gains[position] * max(remaining_limit, 0) / cost
+        bound += positive_stocks.gains[position]
+        remaining_limit -= cost
+    return bound
+
+
+def certify(purchase_limit: float, stocks: Stocks, purchase_list: list) -> Certificate:
+    """
+    Certifies a purchase list of any solver against the LP relaxation upper bound
+    :param purchase_limit: maximum amount to be expended in stock purchases
+    :type purchase_limit: float
+    :param stocks: all stock data
+    :type stocks: Stocks
+    :param purchase_list: purchase list to be certified
+    :type purchase_list: list
+    :return: gain, upper bound and feasibility of the purchase list
+    :rtype: Certificate
+    """
+    return Certificate(
+        stocks.total_gain(purchase_list), lp_upper_bound(purchase_limit, stocks),
+        all(quantity in (0, 1) for quantity in purchase_list)
+        and stocks.total_cost(purchase_list) <= purchase_limit + GAIN_TOLERANCE
+    )
@@ -0,0 +1,201 @@
+import time
+
+from bruteforce import CommonFunctions, Stocks
+from branchandbound import BranchAndBound
+from optimized import Optimized
+
+try:
+    import numpy as np
+except ImportError:
+    # The ratio sort, greedy fill and swap candidates fall back on python lists
+    np = None
+
+
+class Heuristic:
+    """
+    Fast approximate purchase lists: greedy fill by gain / price ratio improved by local search swaps
+    """
+
+    # Number of purchased and not purchased stocks around the greedy break stock considered by the swaps
+    CORE_SIZE = 16
+    # Maximum number of improving swaps applied after the greedy fill
+    MAX_PASSES = 10
+
+    def __init__(self, common_functions: CommonFunctions):
+        self.common_functions = common_functions
+
+    @staticmethod
+    def greedy_fill(costs: list, order: list, purchase_limit: float) -> tuple:
+        """
+        Buys the stocks in ratio order, skipping the ones that do not fit in the remaining limit
+        :param costs: stock prices
+        :type costs: list
+        :param order: stock positions by decreasing ratio
+        :type order: list
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: float
+        :return: purchase list and remaining limit
+        :rtype: tuple
+        """
+        purchase_list = [0] * len(costs)
+        remaining_limit = purchase_limit
+        for stock_index in order:
+            if costs[stock_index] <= remaining_limit:
+                purchase_list[stock_index] = 1
+                remaining_limit -= costs[stock_index]
+        return purchase_list, remaining_limit
+
+    @staticmethod
+    def greedy_fill_numpy(costs, order, purchase_limit: float) -> tuple:
+        """
+        Buys the stocks in ratio order like greedy_fill: the prefix fitting in the limit is read from the running
+        remaining limit, subtracted in the same order as greedy_fill so that exact fits round alike, then each next
+        stock still fitting is found by one vectorized comparison
+        :param costs: stock prices
+        :type costs: numpy.ndarray
+        :param order: stock positions by decreasing ratio
+        :type order: numpy.ndarray
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: float
+        :return: purchased mask and remaining limit
+        :rtype: tuple
+        """
+        purchased = np.zeros(len(costs), dtype=bool)
+        remaining_limits = np.subtract.accumulate(np.concatenate(([purchase_limit], costs[order])))
+        overspent = np.flatnonzero(remaining_limits < 0)
+        end = int(overspent[0]) - 1 if overspent.size else len(order)
+        purchased[order[:end]] = True
+        remaining_limit = float(remaining_limits[end])
+        # The stock at end does not fit, the next ones are bought while any of them fits
+        rest = order[end + 1:]
+        while rest.size:
+            fitting = np.flatnonzero(costs[rest] <= remaining_limit)
+            if not fitting.size:
+                break
+            purchased[rest[fitting[0]]] = True
+            remaining_limit -= float(costs[rest[fitting[0]]])
+            rest = rest[fitting[0] + 1:]
+        return purchased, remaining_limit
+
+    @staticmethod
+    def find_best_swap(costs: list, gains: list, bought: list, available: list, remaining_limit: float) -> tuple:
+        """
+        Finds the most profitable move among adding one stock, replacing one stock by one or two stocks, and
+        replacing two stocks by one stock
+        :param costs: stock prices
+        :type costs: list
+        :param gains: stock gains
+        :type gains: list
+        :param bought: purchased stock positions considered for removal
+        :type bought: list
+        :param available: not purchased stock positions considered for purchase
+        :type available: list
+        :param remaining_limit: amount not expended yet
+        :type remaining_limit: float
+        :return: gain improvement, positions removed and positions added, improvement 0 if there is no move
+        :rtype: tuple
+        """
+        best_move = (0, (), ())
+        pairs = [
+            (costs[first] + costs[second], gains[first] + gains[second], (first, second))
+            for index, first in enumerate(available) for second in available[index + 1:]
+        ]
+        removed_pairs = [
+            (costs[first] + costs[second], gains[first] + gains[second], (first, second))
+            for index, first in enumerate(bought) for second in bought[index + 1:]
+        ]
+        for added in available:
+            if costs[added] <= remaining_limit and gains[added] > best_move[0]:
+                best_move = (gains[added], (), (added,))
+            for removed_cost, removed_gain, removed in removed_pairs:
+                improvement = gains[added] - removed_gain
+                if improvement > best_move[0] and costs[added] - removed_cost <= remaining_limit:
+                    best_move = (improvement, removed, (added,))
+        for removed in bought:
+            limit = remaining_limit + costs[removed]
+            for added in available:
+                improvement = gains[added] - gains[removed]
+                if improvement > best_move[0] and costs[added] <= limit:
+                    best_move = (improvement, (removed,), (added,))
+            for added_cost, added_gain, added in pairs:
+                improvement = added_gain - gains[removed]
+                if improvement > best_move[0] and added_cost <= limit:
+                    best_move = (improvement, (removed,), added)
+        return best_move
+
+    def heuristic_calculation(self, purchase_limit: float, stocks: Stocks) -> list:
+        """
+        Calculates a good purchase option in O(n log n) plus MAX_PASSES bounded local search passes. The greedy
+        fill is improved by the best 1-swap or 2-swap among the CORE_SIZE last purchased and first skipped stocks,
+        where the greedy choice is the least certain. The sort, fill and swap candidates are vectorized when numpy
+        is installed.
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: float
+        :param stocks: all stock data
+        :type stocks: Stocks
+        :return: purchase list
+        :rtype: list
+        """
+        costs = stocks.costs.tolist()
+        gains = stocks.gains.tolist()
+        if np is not None:
+            costs_array = np.frombuffer(stocks.costs)
+            profits_array = np.frombuffer(stocks.profits)
+            candidates = np.flatnonzero((costs_array > 0) & (profits_array > 0))
+            # gain / price is the gain percentage, the stable sort keeps the order of sort_by_ratio on ties
+            order = candidates[np.argsort(-profits_array[candidates], kind='stable')]
+            purchase_list, remaining_limit = self.greedy_fill_numpy(costs_array, order, purchase_limit)
+        else:
+            order = BranchAndBound.sort_by_ratio(stocks)
+            purchase_list, remaining_limit = self.greedy_fill(costs, order, purchase_limit)
+
+        for _ in range(self.MAX_PASSES):
+            if np is not None:
+                ordered_purchases = purchase_list[order]
+                bought = order[ordered_purchases][-self.CORE_SIZE:].tolist()
+                available = order[~ordered_purchases][:self.CORE_SIZE].tolist()
+            else:
+                bought = [stock_index for stock_index in order if purchase_list[stock_index]][-self.CORE_SIZE:]
+                available = [stock_index for stock_index in order if not purchase_list[stock_index]][:self.CORE_SIZE]
+            improvement, removed, added = self.find_best_swap(costs, gains, bought, available, remaining_limit)
+            if improvement <= 0:
+                break
+            for stock_index in removed:
+                purchase_list[stock_index] = 0
+                remaining_limit += costs[stock_index]
+            for stock_index in added:
+                purchase_list[stock_index] = 1
+                remaining_limit -= costs[stock_index]
+        return purchase_list.astype(int).tolist() if np is not None else purchase_list
+
+    def heuristic_gap(self, purchase_limit: float, stocks: Stocks) -> float:
+        """
+        Calculates how far the heuristic purchase list lands from the dynamic programming optimum
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: float
+        :param stocks: all stock data
+        :type stocks: Stocks
+        :return: relative gap, (optimal gain - heuristic gain) / optimal gain
+        :rtype: float
+        """
+        optimal_gain = stocks.total_gain(Optimized(self.common_functions).knapsack_calculation(purchase_limit, stocks))
+        heuristic_gain = stocks.total_gain(self.heuristic_calculation(purchase_limit, stocks))
+        return (optimal_gain - heuristic_gain) / optimal_gain if optimal_gain else 0.0
+
+
+def main():
+    common_functions = CommonFunctions()
+    heuristic = Heuristic(common_functions)
+    for file_path in (common_functions.DATASET_FILE, "test_datasets/dataset1.csv", "test_datasets/dataset2.csv"):
+        stocks = common_functions.csv_to_stocks(file_path)
+        start_time = time.perf_counter()
+        best_list = heuristic.heuristic_calculation(500, stocks)
+        elapsed = time.perf_counter() - start_time
+        print(file_path)
+        print(stocks.purchased_names(best_list))
+        print(stocks.total_gain(best_list))
+        print("--- %s seconds, %.4f%% from optimum ---" % (elapsed, 100 * heuristic.heuristic_gap(500, stocks)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import copy
+import time
+
+from array import array
+
+from bruteforce import CommonFunctions, Stocks
+from optimized import Optimized
+
+
+class IncrementalKnapsack:
+    """
+    Knapsack solver keeping its table between runs, so that a few changed prices or gains only recompute
+    the part of the table they invalidate. Changed and added stocks are moved to the end of the stocks order:
+    the rows of the unchanged stocks before them are kept, and stocks changing again are already last.
+    The speedup only holds for stocks changing repeatedly, or declared volatile when solving: the first change of
+    a stock still early in the order recomputes the table from the checkpoint before it, close to a full solve
+    when the changes are scattered.
+    """
+
+    # Number of stocks between two saved rows of best values, a change restarts from the saved row before it
+    CHECKPOINT_INTERVAL = 32
+
+    def __init__(self, common_functions: CommonFunctions, precision: int = 2, memory_lean: bool = False,
+                 backend: str = None):
+        self.common_functions = common_functions
+        self.optimized = Optimized(common_functions)
+        self.precision = precision
+        self.memory_lean = memory_lean
+        self.backend = self.optimized.get_backend(backend)
+        self.capacity = 0
+        self.names = []
+        self.prices = []
+        self.profits = []
+        self.costs = []
+        self.values = []
+        self.decisions = []
+        self.checkpoints = []
+        self.row = None
+        self.stocks = Stocks((), array('d'), array('d'))
+        self.recomputed = 0
+
+    def empty_row(self):
+        """
+        Gets the best values row without any stock
+        :return: zeros row of the backend
+        :rtype: list
+        """
+        if self.backend == 'numpy':
+            return self.optimized.knapsack_table_numpy([], [], self.capacity)[0]
+        return array('q', bytes(8 * (self.capacity + 1))) if self.memory_lean else [0] * (self.capacity + 1)
+
+    def fill(self, start: int):
+        """
+        Recomputes the table from a checkpoint position to the last stock, saving a row every CHECKPOINT_INTERVAL
+        :param start: first stock to recompute, a multiple of CHECKPOINT_INTERVAL
+        :type start: int
+        """
+        checkpoint = start // self.CHECKPOINT_INTERVAL
+        del self.checkpoints[checkpoint + 1:]
+        del self.decisions[start:]
+        row = copy.copy(self.checkpoints[checkpoint])
+        for block_start in range(start, len(self.costs), self.CHECKPOINT_INTERVAL):
+            if block_start // self.CHECKPOINT_INTERVAL >= len(self.checkpoints):
+                self.checkpoints.append(copy.copy(row))
+            block_end = block_start + self.CHECKPOINT_INTERVAL
+            row, decisions = self.optimized.knapsack_table(
+                self.costs[block_start:block_end], self.values[block_start:block_end], self.capacity,
+                self.memory_lean, self.backend, row
+            )
+            self.decisions.extend(decisions)
+        # The row after the last stock starts the next block when the stocks fill whole blocks, an update only
+        # adding stocks restarts from it
+        if len(self.costs) // self.CHECKPOINT_INTERVAL >= len(self.checkpoints):
+            self.checkpoints.append(copy.copy(row))
+        self.row = row
+        self.recomputed = len(self.costs) - start
+        self.stocks = Stocks(tuple(self.names), array('d', self.prices), array('d', self.profits))
+
+    def solve(self, purchase_limit: float, stocks: Stocks, volatile_names: list = None) -> list:
+        """
+        Calculates the best purchase option from scratch, keeping the table for the next updates
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: float
+        :param stocks: all stock data
+        :type stocks: Stocks
+        :param volatile_names: names of the stocks expected to change, placed last so that their first change only
+            recomputes the end of the table
+        :type volatile_names: list
+        :return: best purchase list, aligned with self.stocks
+        :rtype: list
+        """
+        if volatile_names:
+            volatile = set(volatile_names)
+            stocks = stocks.select(
+                [position for position, name in enumerate(stocks.names) if name not in volatile]
+                + [position for position, name in enumerate(stocks.names) if name in volatile]
+            )
+        self.capacity = round(purchase_limit * 10 ** self.precision)
+        self.names = list(stocks.names)
+        self.prices = list(stocks.costs)
+        self.profits = list(stocks.profits)
+        self.costs, self.values = self.optimized.to_knapsack_units(stocks, self.precision)
+        self.checkpoints = [self.empty_row()]
+        self.decisions = []
+        self.fill(0)
+        return self.purchase_list()
+
+    def update(self, changed_stocks: Stocks = None, removed_names: list = None) -> list:
+        """
+        Applies a delta of changed, added and removed stocks and recomputes the invalidated part of the table once:
+        from the checkpoint before the first changed or removed stock, the changed and added stocks going last
+        :param changed_stocks: stocks with a new price or gain, and new stocks
+        :type changed_stocks: Stocks
+        :param removed_names: names of the stocks to be removed
+        :type removed_names: list
+        :return: best purchase list, aligned with self.stocks
+        :rtype: list
+        """
+        changed_stocks = changed_stocks if changed_stocks else Stocks((), array('d'), array('d'))
+        affected = set(changed_stocks.names).union(removed_names if removed_names else ())
+        positions = [position for position, name in enumerate(self.names) if name in affected]
+        if not positions and not len(changed_stocks):
+            return self.purchase_list()
+        first = positions[0] if positions else len(self.names)
+        start = first - first % self.CHECKPOINT_INTERVAL
+
+        kept = [position for position in range(start, len(self.names)) if self.names[position] not in affected]
+        changed_costs, changed_values = self.optimized.to_knapsack_units(changed_stocks, self.precision)
+        for attribute, changed_column in (
+                ('names', changed_stocks.names), ('prices', changed_stocks.costs),
+                ('profits', changed_stocks.profits), ('costs', changed_costs), ('values', changed_values)
+        ):
+            column = getattr(self, attribute)
+            column[start:] = [column[position] for position in kept] + list(changed_column)
+        self.fill(start)
+        return self.purchase_list()
+
+    def purchase_list(self) -> list:
+        """
+        Rebuilds the best purchase list from the kept table
+        :return: best purchase list, aligned with self.stocks
+        :rtype: list
+        """
+        return self.optimized.knapsack_backtrack(self.costs, self.decisions, self.capacity, self.memory_lean)
+
+
+def main():
+    common_functions = CommonFunctions()
+    incremental = IncrementalKnapsack(common_functions)
+    stocks = common_functions.csv_to_stocks("test_datasets/dataset1.csv")
+
+    # The same 5 stocks tick twice: the first update moves them last, the second one only recomputes them
+    ticking = [2, 150, 400, 700, 950]
+    start_time = time.perf_counter()
+    best_list = incremental.solve(500, stocks)
+    print("full solve: %s seconds, gain %s" % (time.perf_counter() - start_time, stocks.total_gain(best_list)))
+    for tick in (1.01, 0.99):
+        changed = stocks.select(ticking)
+        changed = Stocks(changed.names, array('d', [round(cost * tick, 2) for cost in changed.costs]), changed.profits)
+        start_time = time.perf_counter()
+        best_list = incremental.update(changed)
+        print("update: %s seconds, %s stocks recomputed, gain %s" % (
+            time.perf_counter() - start_time, incremental.recomputed, incremental.stocks.total_gain(best_list)))
+
+    # Declared volatile when solving, the 5 stocks are last from the start and their first change is cheap too
+    incremental.solve(500, stocks, volatile_names=[stocks.names[position] for position in ticking])
+    changed = stocks.select(ticking)
+    changed = Stocks(changed.names, array('d', [round(cost * 1.01, 2) for cost in changed.costs]), changed.profits)
+    start_time = time.perf_counter()
+    best_list = incremental.update(changed)
+    print("volatile update: %s seconds, %s stocks recomputed, gain %s" % (
+        time.perf_counter() - start_time, incremental.recomputed, incremental.stocks.total_gain(best_list)))
+
+
+if __name__ == "__main__":
+    main()
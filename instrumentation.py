@@ -0,0 +1,75 @@
+import logging
+import time
+
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+
+logger = logging.getLogger(__name__)
+
+
+class SolveStats:
+    """
+    Opt-in counters and phase timers of a solve. Solvers take an optional stats object and only update it
+    outside their inner loops when one is given, so a solve without stats runs the exact same code as before.
+    Counters used by the solvers: nodes_explored, nodes_pruned, dp_cells, cache_hits, cache_misses.
+    Phases: load, preprocess, solve, backtrack.
+    """
+
+    def __init__(self, callback=None):
+        """
+        :param callback: called with the counters and phase seconds dictionary each time a phase ends
+        :type callback: callable
+        """
+        self.counters = Counter()
+        self.phase_seconds = Counter()
+        self.callback = callback
+
+    def count(self, name: str, amount: int = 1):
+        """
+        Adds to a counter
+        :param name: counter name
+        :type name: str
+        :param amount: value added
+        :type amount: int
+        """
+        self.counters[name] += amount
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Times a phase, the seconds of a phase run several times being summed
+        :param name: phase name
+        :type name: str
+        """
+        start_time = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.phase_seconds[name] += time.perf_counter() - start_time
+            logger.debug("%s phase done in %.6f seconds", name, self.phase_seconds[name])
+            if self.callback is not None:
+                self.callback(self.as_dict())
+
+    def as_dict(self) -> dict:
+        """
+        Gets the counters and phase timers
+        :return: {'counters': {name: value}, 'phase_seconds': {name: seconds}}
+        :rtype: dict
+        """
+        return {'counters': dict(self.counters), 'phase_seconds': dict(self.phase_seconds)}
+
+    def __repr__(self):
+        return f"SolveStats({self.as_dict()})"
+
+
+def measure_phase(stats: SolveStats, name: str):
+    """
+    Gets the timer of a phase, doing nothing when there are no stats
+    :param stats: stats of the solve, None if instrumentation is disabled
+    :type stats: SolveStats
+    :param name: phase name
+    :type name: str
+    :return: context manager
+    """
+    return nullcontext() if stats is None else stats.phase(name)
@@ -0,0 +1,218 @@
+import time
+
+from bisect import bisect_right
+from decimal import Decimal
+from heapq import merge
+
+from bruteforce import CommonFunctions, Stocks
+from instrumentation import SolveStats, measure_phase
+from optimized import Optimized
+
+try:
+    import numpy as np
+except ImportError:
+    # Subset sums fall back on sorted python lists
+    np = None
+
+
+class MeetInTheMiddle:
+    """
+    Exact solver for a few dozen stocks with prices of any number of decimals: the stocks are split in two halves,
+    the subset sums of each half are enumerated and every subset of one half is paired with the best fitting
+    subset of the other half by binary search, in O(2 ** (n / 2) * log) instead of O(2 ** n)
+    """
+
+    # Subsets are stored as bit masks, one int64 per subset
+    MAX_HALF_SIZE = 62
+    # Integer budget units are kept under this bound so that numpy int64 sums never overflow
+    MAX_UNITS = 2 ** 62
+
+    def __init__(self, common_functions: CommonFunctions):
+        self.common_functions = common_functions
+
+    @staticmethod
+    def to_exact_units(costs: list, purchase_limit: float) -> tuple:
+        """
+        Converts prices and purchase limit into integers without rounding: all of them are scaled by 10 to the
+        largest number of decimals found in their shortest representation
+        :param costs: stock prices
+        :type costs: list
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: float
+        :return: integer costs and integer capacity
+        :rtype: tuple
+        """
+        decimals = [Decimal(repr(float(value))) for value in list(costs) + [purchase_limit]]
+        precision = max(0, max(-value.as_tuple().exponent for value in decimals))
+        units = [int(value.scaleb(precision)) for value in decimals]
+        return units[:-1], units[-1]
+
+    @staticmethod
+    def pareto_subset_sums_numpy(costs: list, gains: list, cost_cap: int) -> tuple:
+        """
+        Enumerates the subset sums of a few stocks, keeping only the non dominated ones: a subset is dropped as soon
+        as another one costs at most as much for at least as much gain, since any completion of the first one is
+        beaten by the same completion of the second one. Subsets costing more than cost_cap are dropped too.
+        :param costs: integer stock costs
+        :type costs: list
+        :param gains: stock gains
+        :type gains: list
+        :param cost_cap: largest subset cost worth keeping
+        :type cost_cap: int
+        :return: subset costs sorted increasingly, subset gains (strictly increasing too), subset bit masks and
+        number of subsets enumerated
+        :rtype: tuple
+        """
+        subset_costs = np.zeros(1, dtype=np.int64)
+        subset_gains = np.zeros(1, dtype=np.float64)
+        masks = np.zeros(1, dtype=np.int64)
+        enumerated = 1
+        for bit, (cost, gain) in enumerate(zip(costs, gains)):
+            added_costs = subset_costs + cost
+            fitting = added_costs <= cost_cap
+            added_costs = added_costs[fitting]
+            added_gains = subset_gains[fitting] + gain
+            added_masks = masks[fitting] | (1 << bit)
+            enumerated += len(added_costs)
+
+            # Both lists are sorted by cost, the stable sort merges their two runs in linear time
+            order = np.argsort(np.concatenate((subset_costs, added_costs)), kind='stable')
+            subset_costs = np.concatenate((subset_costs, added_costs))[order]
+            subset_gains = np.concatenate((subset_gains, added_gains))[order]
+            masks = np.concatenate((masks, added_masks))[order]
+
+            # A subset is kept if it beats the gain of all cheaper ones, and of the ones costing as much before it
+            best_before = np.maximum.accumulate(subset_gains)
+            kept = np.empty(len(subset_gains), dtype=bool)
+            kept[0] = True
+            kept[1:] = subset_gains[1:] > best_before[:-1]
+            subset_costs, subset_gains, masks = subset_costs[kept], subset_gains[kept], masks[kept]
+            # Of two kept subsets costing as much, the second one gains more
+            kept = np.empty(len(subset_costs), dtype=bool)
+            kept[-1] = True
+            kept[:-1] = subset_costs[:-1] != subset_costs[1:]
+            subset_costs, subset_gains, masks = subset_costs[kept], subset_gains[kept], masks[kept]
+        return subset_costs, subset_gains, masks, enumerated
+
+    @staticmethod
+    def pareto_subset_sums(costs: list, gains: list, cost_cap: int) -> tuple:
+        """
+        Pure python version of pareto_subset_sums_numpy
+        :param costs: integer stock costs
+        :type costs: list
+        :param gains: stock gains
+        :type gains: list
+        :param cost_cap: largest subset cost worth keeping
+        :type cost_cap: int
+        :return: subset costs sorted increasingly, subset gains, subset bit masks and number of subsets enumerated
+        :rtype: tuple
+        """
+        subsets = [(0, 0.0, 0)]
+        enumerated = 1
+        for bit, (cost, gain) in enumerate(zip(costs, gains)):
+            added = [(subset_cost + cost, subset_gain + gain, mask | (1 << bit))
+                     for subset_cost, subset_gain, mask in subsets if subset_cost + cost <= cost_cap]
+            enumerated += len(added)
+            best_gain = float('-inf')
+            kept = []
+            for subset in merge(subsets, added, key=lambda subset: (subset[0], -subset[1])):
+                if subset[1] > best_gain:
+                    best_gain = subset[1]
+                    kept.append(subset)
+            subsets = kept
+        return [subset[0] for subset in subsets], [subset[1] for subset in subsets], \
+            [subset[2] for subset in subsets], enumerated
+
+    def meet_in_the_middle_calculation(
+            self, purchase_limit: float, stocks: Stocks, backend: str = None, stats: SolveStats = None
+    ) -> list:
+        """
+        Calculates the best purchase option on the exact prices. Stocks with a non positive price and a non negative
+        gain are always bought, stocks with a non negative price and a non positive gain never are, the other ones
+        are split in two halves. For each subset of the first half, the best subset of the second half is the most
+        expensive one fitting in the remaining limit, the non dominated subsets having increasing costs and gains.
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: float
+        :param stocks: all stock data
+        :type stocks: Stocks
+        :param backend: 'numpy' or 'python', numpy when installed if not declared
+        :type backend: str
+        :param stats: collects the phase times, the subsets enumerated and the subsets pruned by dominance
+        :type stats: SolveStats
+        :return: best purchase list
+        :rtype: list
+        """
+        with measure_phase(stats, 'preprocess'):
+            costs, capacity = self.to_exact_units(stocks.costs, purchase_limit)
+            gains = stocks.gains
+            purchase_list = [0] * len(stocks)
+            candidates = []
+            for stock_index, (cost, gain) in enumerate(zip(costs, gains)):
+                if cost <= 0 and gain >= 0:
+                    purchase_list[stock_index] = 1
+                    capacity -= cost
+                elif cost < 0 or gain > 0:
+                    candidates.append(stock_index)
+            if len(candidates) > 2 * self.MAX_HALF_SIZE:
+                raise ValueError(f"meet in the middle is limited to {2 * self.MAX_HALF_SIZE} candidate stocks")
+
+            # Stocks with a negative price give back budget, a subset may go over the capacity before adding them
+            cost_cap = capacity - sum(costs[stock_index] for stock_index in candidates if costs[stock_index] < 0)
+            backend = Optimized.get_backend(backend)
+            if sum(abs(costs[stock_index]) for stock_index in candidates) + abs(capacity) >= self.MAX_UNITS:
+                backend = 'python'
+            halves = (candidates[:len(candidates) // 2], candidates[len(candidates) // 2:])
+
+        with measure_phase(stats, 'solve'):
+            pareto_subset_sums = self.pareto_subset_sums_numpy if backend == 'numpy' else self.pareto_subset_sums
+            (first_costs, first_gains, first_masks, first_count), (second_costs, second_gains, second_masks,
+                                                                   second_count) = (
+                pareto_subset_sums([costs[stock_index] for stock_index in half],
+                                   [gains[stock_index] for stock_index in half], cost_cap)
+                for half in halves
+            )
+            if backend == 'numpy':
+                partners = np.searchsorted(second_costs, capacity - first_costs, side='right') - 1
+                fitting = partners >= 0
+                totals = np.where(fitting, first_gains + second_gains[np.maximum(partners, 0)], -np.inf)
+                best = int(np.argmax(totals))
+                best_total = totals[best]
+                first_mask, second_mask = int(first_masks[best]), int(second_masks[partners[best]])
+            else:
+                best_total, first_mask, second_mask = float('-inf'), 0, 0
+                for first_cost, first_gain, mask in zip(first_costs, first_gains, first_masks):
+                    partner = bisect_right(second_costs, capacity - first_cost) - 1
+                    if partner >= 0 and first_gain + second_gains[partner] > best_total:
+                        best_total = first_gain + second_gains[partner]
+                        first_mask, second_mask = mask, second_masks[partner]
+            if best_total == float('-inf'):
+                raise ValueError("no purchase list fits in the purchase limit")
+        if stats is not None:
+            stats.count('nodes_explored', first_count + second_count)
+            stats.count('nodes_pruned', first_count + second_count - len(first_costs) - len(second_costs))
+
+        with measure_phase(stats, 'backtrack'):
+            for half, mask in zip(halves, (first_mask, second_mask)):
+                for bit, stock_index in enumerate(half):
+                    if mask >> bit & 1:
+                        purchase_list[stock_index] = 1
+            return purchase_list
+
+
+def main():
+    common_functions = CommonFunctions()
+    meet_in_the_middle = MeetInTheMiddle(common_functions)
+    for file_path in (common_functions.DATASET_FILE, "test_datasets/dataset1.csv", "test_datasets/dataset2.csv"):
+        start_time = time.perf_counter()
+        stocks = common_functions.csv_to_stocks(file_path)
+        # The full datasets are far too large, their first 50 stocks are solved on the exact prices
+        stocks = stocks.select(range(min(50, len(stocks))))
+        best_list = meet_in_the_middle.meet_in_the_middle_calculation(500, stocks)
+        print(file_path)
+        print(stocks.purchased_names(best_list))
+        print(stocks.total_gain(best_list))
+        print("--- %s seconds ---" % (time.perf_counter() - start_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,521 @@
+import logging
+import time
+
+from bisect import bisect_right
+from itertools import accumulate
+
+from anytime import AnytimeResult
+from bruteforce import CommonFunctions, Stocks
+from branchandbound import BranchAndBound
+from instrumentation import SolveStats, measure_phase
+from optimized import Optimized
+
+try:
+    import numpy as np
+except ImportError:
+    # The number of positions is then handled by the branch and bound
+    np = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class PortfolioConstraints:
+    """
+    Compliance rules on top of the purchase limit: a maximum number of purchased stocks and spend caps on the
+    groups of an extra csv column, such as {'sector': {'Energy': 150, 'Tech': 200}}
+    """
+    __slots__ = ('max_positions', 'group_caps')
+
+    def __init__(self, max_positions: int = None, group_caps: dict = None):
+        """
+        :param max_positions: maximum number of purchased stocks, no limit if not declared
+        :type max_positions: int
+        :param group_caps: column name: {group value: maximum amount expended in the group}, groups without
+        a cap are only bound by the purchase limit
+        :type group_caps: dict
+        """
+        self.max_positions = max_positions
+        self.group_caps = group_caps if group_caps else {}
+
+    def side_constraints(self, stocks: Stocks) -> tuple:
+        """
+        Gets the constraints other than the purchase limit as weights and capacities: a weight of 1 per stock for
+        the positions, the stock price for the caps of its groups
+        :param stocks: all stock data, with the capped columns in their attributes
+        :type stocks: Stocks
+        :return: weights of each stock as (constraint, weight) tuples and capacity of each constraint
+        :rtype: tuple
+        """
+        weights = [[] for _ in range(len(stocks))]
+        capacities = []
+        if self.max_positions is not None:
+            for stock_weights in weights:
+                stock_weights.append((len(capacities), 1))
+            capacities.append(self.max_positions)
+        for column, caps in self.group_caps.items():
+            if column not in stocks.attributes:
+                raise KeyError(f"stocks have no {column} column")
+            constraints = {}
+            for group, cap in caps.items():
+                constraints[group] = len(capacities)
+                capacities.append(cap)
+            for stock_weights, group, cost in zip(weights, stocks.attributes[column], stocks.costs):
+                if group in constraints:
+                    stock_weights.append((constraints[group], cost))
+        return weights, capacities
+
+
+class MultiConstraintSolver:
+    """
+    Purchase options under the purchase limit and compliance rules (see PortfolioConstraints): exact dynamic
+    programming or branch and bound with few constraints and few stocks, Lagrangian relaxation heuristic otherwise
+    """
+
+    # Largest number of side constraints and of candidate stocks (see find_candidates) solved exactly when the
+    # method is not declared
+    EXACT_MAX_CONSTRAINTS = 4
+    EXACT_MAX_CANDIDATES = 200
+    # Nodes after which the branch and bound stops, about a second of search, and largest number of cells of the
+    # positions dynamic programming (about a second too) run under this node limit
+    MAX_NODES = 200000
+    POSITIONS_MAX_CELLS = 100000000
+    # Subgradient iterations of the Lagrangian relaxation, the step is halved after STALL_ITERATIONS without
+    # a better upper bound
+    LAGRANGIAN_ITERATIONS = 100
+    STALL_ITERATIONS = 10
+    # Absolute margin on the constraint capacities so that a purchase list using exactly a capacity stays feasible
+    LIMIT_TOLERANCE = 1e-9
+
+    def __init__(self, common_functions: CommonFunctions):
+        self.common_functions = common_functions
+        self.optimized = Optimized(common_functions)
+
+    @staticmethod
+    def greedy_fill(order: list, costs: list, weights: list, remaining: list, purchase_list: list) -> list:
+        """
+        Buys the stocks in the given order, skipping the ones that do not fit in one of the remaining capacities
+        :param order: stock positions, in buying order
+        :type order: list
+        :param costs: stock prices
+        :type costs: list
+        :param weights: (constraint, weight) tuples of each stock
+        :type weights: list
+        :param remaining: remaining purchase limit then remaining side capacities, updated
+        :type remaining: list
+        :param purchase_list: purchase list completed in place
+        :type purchase_list: list
+        :return: purchase list
+        :rtype: list
+        """
+        for stock_index in order:
+            if purchase_list[stock_index] or costs[stock_index] > remaining[0]:
+                continue
+            if all(weight <= remaining[constraint + 1] for constraint, weight in weights[stock_index]):
+                purchase_list[stock_index] = 1
+                remaining[0] -= costs[stock_index]
+                for constraint, weight in weights[stock_index]:
+                    remaining[constraint + 1] -= weight
+        return purchase_list
+
+    def find_candidates(self, purchase_limit: float, stocks: Stocks, constraints: PortfolioConstraints) -> list:
+        """
+        Gets the stocks that can be part of a best purchase list: positive price within the purchase limit, positive
+        gain, and not dominated (see CommonFunctions.find_dominated_stocks) by stocks of the same capped groups,
+        which could replace them without exceeding any cap
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: float
+        :param stocks: all stock data
+        :type stocks: Stocks
+        :param constraints: compliance rules
+        :type constraints: PortfolioConstraints
+        :return: candidate stock positions, by decreasing ratio within each group
+        :rtype: list
+        """
+        signatures = {}
+        for stock_index in BranchAndBound.sort_by_ratio(stocks):
+            if stocks.costs[stock_index] <= purchase_limit:
+                signature = tuple(
+                    stocks.attributes[column][stock_index] if stocks.attributes[column][stock_index] in caps else None
+                    for column, caps in constraints.group_caps.items()
+                )
+                signatures.setdefault(signature, []).append(stock_index)
+        candidates = []
+        for positions in signatures.values():
+            dominated = set(self.common_functions.find_dominated_stocks(
+                [stocks.costs[stock_index] for stock_index in positions],
+                [stocks.gains[stock_index] for stock_index in positions],
+                purchase_limit, constraints.max_positions
+            ))
+            candidates.extend(stock_index for index, stock_index in enumerate(positions) if index not in dominated)
+        return candidates
+
+    def lagrangian_calculation(
+            self, purchase_limit: float, stocks: Stocks, constraints: PortfolioConstraints, stats: SolveStats = None
+    ) -> tuple:
+        """
+        Calculates a good purchase option by Lagrangian relaxation of the side constraints: each one gets a price,
+        removed from the gain of the stocks using it, and the purchase limit alone is solved by the fractional
+        knapsack on the adjusted gains, which bounds the optimal gain. Prices are tuned by subgradient steps, and
+        each set of prices gives feasible purchase lists by greedily buying the stocks by decreasing adjusted ratio
+        and by decreasing adjusted gain.
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: float
+        :param stocks: all stock data
+        :type stocks: Stocks
+        :param constraints: compliance rules
+        :type constraints: PortfolioConstraints
+        :param stats: collects the phase times and the iterations as nodes explored
+        :type stats: SolveStats
+        :return: best feasible purchase list found, upper bound of the optimal gain and prices of the side
+        constraints giving this bound
+        :rtype: tuple
+        """
+        with measure_phase(stats, 'preprocess'):
+            weights, capacities = constraints.side_constraints(stocks)
+            costs = stocks.costs.tolist()
+            gains = stocks.gains.tolist()
+            candidates = self.find_candidates(purchase_limit, stocks, constraints)
+            limits = [purchase_limit + self.LIMIT_TOLERANCE] + [capacity + self.LIMIT_TOLERANCE
+                                                                for capacity in capacities]
+
+        with measure_phase(stats, 'solve'):
+            best_list = [0] * len(stocks)
+            best_gain = 0.0
+            multipliers = [0.0] * len(capacities)
+            best_multipliers = multipliers
+            upper_bound = float('inf')
+            step_factor = 2.0
+            stall = 0
+            iterations = 0
+            while iterations < self.LAGRANGIAN_ITERATIONS:
+                iterations += 1
+                adjusted = {stock_index: gains[stock_index] - sum(
+                    multipliers[constraint] * weight for constraint, weight in weights[stock_index])
+                    for stock_index in candidates}
+                order = sorted((stock_index for stock_index in candidates if adjusted[stock_index] > 0),
+                               key=lambda stock_index: adjusted[stock_index] / costs[stock_index], reverse=True)
+
+                # Fractional knapsack on the adjusted gains, plus the price of the relaxed capacities
+                relaxed_bound = sum(multiplier * capacity for multiplier, capacity in zip(multipliers, capacities))
+                remaining_limit = limits[0]
+                usage = [0.0] * len(capacities)
+                for stock_index in order:
+                    if costs[stock_index] > remaining_limit:
+                        relaxed_bound += adjusted[stock_index] * remaining_limit / costs[stock_index]
+                        break
+                    remaining_limit -= costs[stock_index]
+                    relaxed_bound += adjusted[stock_index]
+                    for constraint, weight in weights[stock_index]:
+                        usage[constraint] += weight
+                if relaxed_bound < upper_bound - self.LIMIT_TOLERANCE:
+                    upper_bound, best_multipliers = relaxed_bound, multipliers
+                    stall = 0
+                else:
+                    stall += 1
+                    if stall >= self.STALL_ITERATIONS:
+                        step_factor /= 2
+                        stall = 0
+
+                for buying_order in (order, sorted(order, key=adjusted.__getitem__, reverse=True)):
+                    feasible_list = self.greedy_fill(buying_order, costs, weights, list(limits), [0] * len(stocks))
+                    feasible_gain = stocks.total_gain(feasible_list)
+                    if feasible_gain > best_gain:
+                        best_gain, best_list = feasible_gain, feasible_list
+
+                # Capacities used over their limit get a higher price, unused ones a lower one
+                subgradient = [used - capacity for used, capacity in zip(usage, capacities)]
+                norm = sum(value * value for value in subgradient)
+                if norm == 0 or upper_bound - best_gain <= self.LIMIT_TOLERANCE * max(1.0, best_gain):
+                    break
+                step = step_factor * (upper_bound - best_gain) / norm
+                multipliers = [max(0.0, multiplier + step * value)
+                               for multiplier, value in zip(multipliers, subgradient)]
+        if stats is not None:
+            stats.count('nodes_explored', iterations)
+        return best_list, max(upper_bound, best_gain), best_multipliers
+
+    def positions_knapsack_calculation(
+            self, purchase_limit: float, stocks: Stocks, max_positions: int, precision: int = 2,
+            stats: SolveStats = None
+    ) -> list:
+        """
+        Calculates the best purchase option with at most max_positions stocks by dynamic programming over the number
+        of positions and the purchase limit in integer budget units, in O(n * max_positions * W) with one numpy
+        update per stock. Decisions are kept as packed bitsets.
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: float
+        :param stocks: all stock data
+        :type stocks: Stocks
+        :param max_positions: maximum number of purchased stocks
+        :type max_positions: int
+        :param precision: number of decimals kept on prices and gains
+        :type precision: int
+        :param stats: collects the phase times and the number of DP cells computed
+        :type stats: SolveStats
+        :return: best purchase list
+        :rtype: list
+        """
+        with measure_phase(stats, 'preprocess'):
+            constraints = PortfolioConstraints(max_positions=max_positions)
+            candidates = self.find_candidates(purchase_limit, stocks, constraints)
+            costs, values = Optimized.to_knapsack_units(stocks.select(candidates), precision)
+            capacity = round(purchase_limit * 10 ** precision)
+            max_positions = min(max_positions, len(candidates))
+
+        with measure_phase(stats, 'solve'):
+            # Best value with at most r positions (row r) and at most w budget units (column w)
+            table = np.zeros((max_positions + 1, capacity + 1), dtype=np.int64)
+            decisions = []
+            for cost, value in zip(costs, values):
+                if cost > capacity or max_positions == 0:
+                    decisions.append(None)
+                    continue
+                added = table[:-1, :capacity + 1 - cost] + value
+                taken = added > table[1:, cost:]
+                np.maximum(table[1:, cost:], added, out=table[1:, cost:])
+                decisions.append(np.packbits(taken, axis=1, bitorder='little'))
+        if stats is not None:
+            stats.count('dp_cells', sum(max_positions * (capacity + 1 - cost) for cost in costs if cost <= capacity))
+
+        with measure_phase(stats, 'backtrack'):
+            purchase_list = [0] * len(stocks)
+            positions, remaining = max_positions, capacity
+            for index in reversed(range(len(costs))):
+                cost, decision = costs[index], decisions[index]
+                if decision is None or positions == 0 or remaining < cost:
+                    continue
+                cell = remaining - cost
+                if decision[positions - 1, cell >> 3] >> (cell & 7) & 1:
+                    purchase_list[candidates[index]] = 1
+                    positions -= 1
+                    remaining -= cost
+            return purchase_list
+
+    def branch_and_bound_calculation(
+            self,
+            purchase_limit: float,
+            stocks: Stocks,
+            constraints: PortfolioConstraints,
+            stats: SolveStats = None,
+            max_nodes: int = MAX_NODES
+    ) -> AnytimeResult:
+        """
+        Calculates the best purchase option by branch and bound. The Lagrangian relaxation gives the first incumbent
+        and the prices of the side constraints: with gains lowered by these prices, the fractional knapsack on the
+        remaining purchase limit plus the price of the remaining side capacities bounds the gain of any purchase
+        list below a node. Stocks are branched on by decreasing adjusted ratio so that the bound is read from prefix
+        sums, and it is tightened by the highest remaining gains fitting in the remaining positions.
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: float
+        :param stocks: all stock data
+        :type stocks: Stocks
+        :param constraints: compliance rules
+        :type constraints: PortfolioConstraints
+        :param stats: collects the phase times and the search node counters
+        :type stats: SolveStats
+        :param max_nodes: nodes after which the search stops and returns the best purchase list found so far, not
+            proven optimal, with the Lagrangian upper bound. None for no limit.
+        :type max_nodes: int
+        :return: best purchase list found, its gain, an upper bound of the optimal gain and whether it is proven
+            optimal
+        :rtype: AnytimeResult
+        """
+        best_list, upper_bound, multipliers = self.lagrangian_calculation(purchase_limit, stocks, constraints, stats)
+        best_gain = stocks.total_gain(best_list)
+        if upper_bound - best_gain <= self.LIMIT_TOLERANCE * max(1.0, best_gain):
+            return AnytimeResult(best_list, best_gain, upper_bound, proven_optimal=True)
+
+        with measure_phase(stats, 'preprocess'):
+            all_weights, capacities = constraints.side_constraints(stocks)
+            adjusted = {
+                stock_index: stocks.gains[stock_index] - sum(
+                    multipliers[constraint] * weight for constraint, weight in all_weights[stock_index])
+                for stock_index in self.find_candidates(purchase_limit, stocks, constraints)
+            }
+            order = sorted(adjusted, key=lambda stock_index: adjusted[stock_index] / stocks.costs[stock_index],
+                           reverse=True)
+            costs = [stocks.costs[stock_index] for stock_index in order]
+            gains = [stocks.gains[stock_index] for stock_index in order]
+            weights = [tuple(all_weights[stock_index]) for stock_index in order]
+            # Stocks with a non positive adjusted gain are not part of the relaxed optimum
+            adjusted_gains = [max(0.0, adjusted[stock_index]) for stock_index in order]
+            adjusted_ratios = [adjusted_gain / cost for adjusted_gain, cost in zip(adjusted_gains, costs)]
+            prefix_costs = list(accumulate(costs, initial=0))
+            prefix_gains = list(accumulate(adjusted_gains, initial=0))
+            stocks_count = len(order)
+
+            # Sums of the highest gains from each position on, for up to max_positions stocks
+            positions_bounds = None
+            if constraints.max_positions is not None:
+                max_positions = max(0, min(constraints.max_positions, stocks_count))
+                positions_bounds = [None] * (stocks_count + 1)
+                highest = []
+                positions_bounds[stocks_count] = [0.0] * (max_positions + 1)
+                for index in reversed(range(stocks_count)):
+                    highest = sorted(highest + [gains[index]], reverse=True)[:max_positions]
+                    bounds = list(accumulate(highest, initial=0.0))
+                    positions_bounds[index] = bounds + [bounds[-1]] * (max_positions + 1 - len(bounds))
+
+        with measure_phase(stats, 'solve'):
+            bound_factor = 1 + BranchAndBound.BOUND_TOLERANCE
+            best_taken = None
+            proven_optimal = True
+            explored = 0
+            pruned = 0
+            root_remaining = tuple(capacity + self.LIMIT_TOLERANCE for capacity in capacities)
+            stack = [(0, purchase_limit + self.LIMIT_TOLERANCE, root_remaining, 0.0, None)]
+            while stack:
+                index, remaining_limit, remaining, gain, taken = stack.pop()
+                explored += 1
+                if max_nodes is not None and explored > max_nodes:
+                    logger.info("multi constraint search stopped after %s nodes, the result is not proven optimal",
+                                max_nodes)
+                    proven_optimal = False
+                    break
+                if gain > best_gain:
+                    best_gain, best_taken = gain, (taken,)
+                if index == stocks_count:
+                    continue
+
+                limit = prefix_costs[index] + remaining_limit
+                end = bisect_right(prefix_costs, limit, index) - 1
+                bound = gain + prefix_gains[end] - prefix_gains[index] + sum(
+                    multiplier * capacity for multiplier, capacity in zip(multipliers, remaining))
+                if end < stocks_count:
+                    bound += (limit - prefix_costs[end]) * adjusted_ratios[end]
+                if positions_bounds is not None:
+                    bound = min(bound, gain + positions_bounds[index][min(int(remaining[0]), max_positions)])
+                if bound * bound_factor <= best_gain:
+                    pruned += 1
+                    continue
+
+                # Exclude branch is pushed first so that the include branch is explored first
+                stack.append((index + 1, remaining_limit, remaining, gain, taken))
+                if costs[index] <= remaining_limit and all(
+                        weight <= remaining[constraint] for constraint, weight in weights[index]):
+                    child_remaining = list(remaining)
+                    for constraint, weight in weights[index]:
+                        child_remaining[constraint] -= weight
+                    stack.append((index + 1, remaining_limit - costs[index], tuple(child_remaining),
+                                  gain + gains[index], (index, taken)))
+        if stats is not None:
+            stats.count('nodes_explored', explored)
+            stats.count('nodes_pruned', pruned)
+
+        with measure_phase(stats, 'backtrack'):
+            purchase_list = best_list
+            if best_taken is not None:
+                purchase_list = [0] * len(stocks)
+                taken = best_taken[0]
+                while taken is not None:
+                    position, taken = taken
+                    purchase_list[order[position]] = 1
+        gain = stocks.total_gain(purchase_list)
+        return AnytimeResult(purchase_list, gain, gain if proven_optimal else max(upper_bound, gain), proven_optimal)
+
+    def exact_calculation(
+            self,
+            purchase_limit: float,
+            stocks: Stocks,
+            constraints: PortfolioConstraints,
+            stats: SolveStats = None,
+            max_nodes: int = MAX_NODES
+    ) -> AnytimeResult:
+        """
+        Calculates the best purchase option. When the only side constraint is the number of positions and numpy is
+        installed, the knapsack without this constraint is solved first and is the optimum if it holds few enough
+        stocks, the positions dynamic programming is run otherwise if its table has at most POSITIONS_MAX_CELLS cells
+        (whatever its size without a node limit). Branch and bound in the other cases.
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: float
+        :param stocks: all stock data
+        :type stocks: Stocks
+        :param constraints: compliance rules
+        :type constraints: PortfolioConstraints
+        :param stats: collects the phase times and the search counters
+        :type stats: SolveStats
+        :param max_nodes: node limit of the branch and bound, see branch_and_bound_calculation
+        :type max_nodes: int
+        :return: best purchase list found, its gain, an upper bound of the optimal gain and whether it is proven
+            optimal
+        :rtype: AnytimeResult
+        """
+        if not constraints.group_caps and constraints.max_positions is not None and np is not None:
+            candidates = self.find_candidates(purchase_limit, stocks, constraints)
+            purchase_list = [0] * len(stocks)
+            for stock_index, quantity in zip(candidates, self.optimized.knapsack_calculation(
+                    purchase_limit, stocks.select(candidates), stats=stats)):
+                purchase_list[stock_index] = quantity
+            if sum(purchase_list) <= constraints.max_positions:
+                gain = stocks.total_gain(purchase_list)
+                return AnytimeResult(purchase_list, gain, gain, proven_optimal=True)
+            cells = len(candidates) * min(constraints.max_positions, len(candidates)) * round(purchase_limit * 100)
+            if max_nodes is None or cells <= self.POSITIONS_MAX_CELLS:
+                purchase_list = self.positions_knapsack_calculation(
+                    purchase_limit, stocks, constraints.max_positions, stats=stats)
+                gain = stocks.total_gain(purchase_list)
+                return AnytimeResult(purchase_list, gain, gain, proven_optimal=True)
+        return self.branch_and_bound_calculation(purchase_limit, stocks, constraints, stats, max_nodes)
+
+    def multi_constraint_calculation(
+            self,
+            purchase_limit: float,
+            stocks: Stocks,
+            constraints: PortfolioConstraints,
+            method: str = None,
+            stats: SolveStats = None,
+            max_nodes: int = MAX_NODES
+    ) -> AnytimeResult:
+        """
+        Calculates the best purchase option under the purchase limit and the compliance rules
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: float
+        :param stocks: all stock data
+        :type stocks: Stocks
+        :param constraints: compliance rules
+        :type constraints: PortfolioConstraints
+        :param method: 'exact' or 'lagrangian'. If not declared, exact up to EXACT_MAX_CONSTRAINTS side constraints
+            when the positions dynamic programming applies or when there are at most EXACT_MAX_CANDIDATES candidate
+            stocks, Lagrangian otherwise.
+        :type method: str
+        :param stats: collects the phase times and the search counters
+        :type stats: SolveStats
+        :param max_nodes: node limit of the exact branch and bound, see branch_and_bound_calculation
+        :type max_nodes: int
+        :return: best purchase list found, its gain, an upper bound of the optimal gain and whether it is proven
+            optimal
+        :rtype: AnytimeResult
+        """
+        if method is None:
+            _, capacities = constraints.side_constraints(stocks)
+            method = 'lagrangian'
+            if len(capacities) <= self.EXACT_MAX_CONSTRAINTS and (
+                    not constraints.group_caps and np is not None
+                    or len(self.find_candidates(purchase_limit, stocks, constraints)) <= self.EXACT_MAX_CANDIDATES):
+                method = 'exact'
+        if method == 'exact':
+            return self.exact_calculation(purchase_limit, stocks, constraints, stats, max_nodes)
+        if method == 'lagrangian':
+            best_list, upper_bound, _ = self.lagrangian_calculation(purchase_limit, stocks, constraints, stats)
+            gain = stocks.total_gain(best_list)
+            return AnytimeResult(best_list, gain, upper_bound,
+                                 upper_bound - gain <= self.LIMIT_TOLERANCE * max(1.0, gain))
+        raise ValueError(f"unknown multi constraint method: {method}")
+
+
+def main():
+    common_functions = CommonFunctions()
+    solver = MultiConstraintSolver(common_functions)
+    stocks = common_functions.csv_to_stocks("test_datasets/dataset1.csv")
+    for constraints in (PortfolioConstraints(max_positions=5), PortfolioConstraints(max_positions=10)):
+        start_time = time.perf_counter()
+        result = solver.multi_constraint_calculation(500, stocks, constraints)
+        print("at most %s positions" % constraints.max_positions)
+        print(stocks.purchased_names(result.purchase_list))
+        print(f"{result.gain} (upper bound {result.upper_bound}, proven optimal: {result.proven_optimal})")
+        print("--- %s seconds ---" % (time.perf_counter() - start_time))
+
+
+if __name__ == "__main__":
+    main()
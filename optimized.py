@@ -1,14 +1,31 @@
-import multiprocessing
+import logging
 import time
 import copy
 
-from operator import getitem
+from array import array
+from itertools import repeat
+from operator import add, getitem, lt
 from collections import OrderedDict
 
-from bruteforce import CommonFunctions
+from anytime import AnytimeSolver
+from bruteforce import CommonFunctions, Stocks
+from cache import SolveCache
+from instrumentation import SolveStats, measure_phase
+
+try:
+    import numpy as np
+except ImportError:
+    # The knapsack falls back on the pure python row update
+    np = None
+
+logger = logging.getLogger(__name__)
 
 
 class Optimized:
+    # Peak RSS ceiling of the memory lean knapsack for 10,000 stocks and a 100,000 units capacity: 159 MB measured
+    # with numpy (125 MB of packed decisions), plus a 20% margin. Checked by benchmark.check_memory_lean_ceiling.
+    MEMORY_LEAN_CEILING_MB = 192
+
     def __init__(self, common_functions: CommonFunctions):
         self.common_functions = common_functions
 
@@ -42,14 +59,11 @@ class Optimized:
         for key, value in stock_price_dict.items():
             if current_sum + value < purchase_limit:
                 temp_sum = current_sum + value
-                print(key + " - " + str(value))
-                print(type(price_dict_result))
+                logger.debug("%s - %s", key, value)
                 price_dict_result[key] = value
                 stock_name_list_result.append(key)
                 remaining_dict = stock_price_dict.copy()
-                for key2, value2 in remaining_dict.items():
-                    print("remaining dict")
-                    print(key2 + " - " + str(value2))
+                logger.debug("remaining dict: %s", remaining_dict)
                 del remaining_dict[key]
                 remaining_possible_stocks = {
                     key: value for key, value in remaining_dict.items() if value < (purchase_limit - current_sum)}
@@ -62,7 +76,7 @@ class Optimized:
                 )
                 del price_dict_result[key]
 
-        print(f" output: {output}")
+        logger.debug("output: %s", output)
 
     def optimized_calculation(
             self,
@@ -76,117 +90,420 @@ class Optimized:
             best_list: list = None
     ) -> list:
         """
-                Calculates the best purchase option for a given limit and a given list of stock prices and expected gains
-                :param best_list: takes into account the last bast_list found so far. Empty if not declared.
-                :type best_list: list
-                :param purchase_limit: maximum amount to be expended in stock purchases
-                :type purchase_limit: int
-                :param current_sum: ongoing sum of prices
-                :type current_sum: int
-                :param stock_index: stock position for which we try all purchase options
-                :type stock_index: int
-                :param stock_names_list: all stock names
-                :type stock_names_list: list
-                :param stock_price_list: all stock prices
-                :type stock_price_list: list
-                :param stocks_dict: all stock data
-                :type stocks_dict: dict
-                :param purchase_list: ongoing list of purchases
-                :type purchase_list: list
-                :return: best purchase list
-                :rtype: list
-                """
-        # Declaration of best list variable that will stock the best solution found by the algo
-        # Empty list if not provided
+        Calculates the best purchase option for a given limit and a given list of stock prices and expected gains,
+        each stock being either bought or not. The price list is walked in order with the running sum of the
+        bought prices, a stock being only bought while the sum can still come back within the limit.
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: int
+        :param current_sum: ongoing sum of prices, 0 on the first call
+        :type current_sum: int
+        :param stock_index: stock position for which we try both purchase options, 0 on the first call
+        :type stock_index: int
+        :param stock_names_list: all stock names
+        :type stock_names_list: list
+        :param stock_price_list: all stock prices, in the order of stock_names_list
+        :type stock_price_list: list
+        :param stocks_dict: all stock data
+        :type stocks_dict: dict
+        :param purchase_list: ongoing list of purchases
+        :type purchase_list: list
+        :param best_list: best purchase list found so far, updated in place. Empty if not declared.
+        :type best_list: list
+        :return: best purchase list
+        :rtype: list
+        """
+        purchase_list = purchase_list if purchase_list else [0] * len(stock_price_list)
         best_list = best_list if best_list else [0] * len(stock_price_list)
-        best_gain = self.common_functions.calculate_total_gain(stock_names_list, stocks_dict, best_list)
-
-        purchase_list = purchase_list if purchase_list else [1] * len(stock_price_list)
 
-        # Declaration of the remaining limit value
-        total_cost = self.common_functions.calculate_total_cost(
-            purchase_list, stock_names_list, stocks_dict
+        # Once every stock is decided, we compare the gain of the purchase list to the best one found so far.
+        # Gains are not truncated like in calculate_total_gain, the prices of the dataset having decimals.
+        if stock_index == len(stock_price_list):
+            if current_sum <= purchase_limit + 1e-9:
+                current_gain, best_gain = (
+                    sum(quantity * stocks_dict[stock_name]['Cout'] * stocks_dict[stock_name]['Benefice']
+                        for quantity, stock_name in zip(stock_list, stock_names_list))
+                    for stock_list in (purchase_list, best_list)
+                )
+                if current_gain > best_gain:
+                    best_list[:] = purchase_list
+            return best_list
+
+        # Stocks with a negative price further on give budget back
+        refund = -sum(min(price, 0) for price in stock_price_list[stock_index + 1:])
+        stock_price = stock_price_list[stock_index]
+        if current_sum + stock_price <= purchase_limit + refund + 1e-9:
+            purchase_list[stock_index] = 1
+            self.optimized_calculation(
+                purchase_limit, current_sum + stock_price, stock_index + 1, stock_names_list, stock_price_list,
+                stocks_dict, purchase_list, best_list
+            )
+        purchase_list[stock_index] = 0
+        self.optimized_calculation(
+            purchase_limit, current_sum, stock_index + 1, stock_names_list, stock_price_list, stocks_dict,
+            purchase_list, best_list
         )
+        return best_list
 
-        if not stock_price_list:
-            output.append(copy.copy(result))
-
-        for price in stock_price_list:
-            temp_sum = current_sum + price
-
-
-        # We test all purchases quantity options possible in the remaining purchase limit
-        max_range = min(int((total_cost - purchase_limit) / stock_price_list[stock_index] + 1), 2)
-        for purchase_quantity in reversed(range(0, max_range)):
-            # We update the purchases quantity in the purchase list position of the given stock
-            purchase_list[stock_index] = purchase_quantity
+    @staticmethod
+    def pack_decisions(decisions_row: bytes) -> bytes:
+        """
+        Packs a row of 0/1 decision bytes into a bitset of 1 bit per capacity
+        :param decisions_row: one byte (0 or 1) per capacity
+        :type decisions_row: bytes
+        :return: bitset, bit (k % 8) of byte (k // 8) holding decision k
+        :rtype: bytes
+        """
+        packed = 0
+        for bit in range(8):
+            # every byte of the slice is 0 or 1, shifting by less than 8 bits never carries into the next byte
+            packed |= int.from_bytes(decisions_row[bit::8], 'little') << bit
+        return packed.to_bytes((len(decisions_row) + 7) // 8, 'little')
+
+    def knapsack_table(
+            self, costs: list, values: list, capacity: int, memory_lean: bool = False, backend: str = None, row=None
+    ) -> tuple:
+        """
+        Fills the 0/1 knapsack dynamic programming table in O(n * capacity). Only one row of best values is kept,
+        each stock adds a row of decisions (1 when buying the stock improves the value for a given capacity).
+        In memory lean mode the values row is an array('q') and decisions are packed bitsets, so the table costs
+        n * capacity / 8 bytes: about 125 MB for 10,000 stocks and a 100,000 units capacity, peak RSS staying
+        under MEMORY_LEAN_CEILING_MB for that problem size.
+        :param costs: stock costs in integer budget units
+        :type costs: list
+        :param values: stock gains as integers
+        :type values: list
+        :param capacity: purchase limit in integer budget units
+        :type capacity: int
+        :param memory_lean: stores decisions as 1 bit per cell instead of 1 byte
+        :type memory_lean: bool
+        :param backend: 'numpy' or 'python', numpy when installed if not declared
+        :type backend: str
+        :param row: best values row of previous stocks, updated in place, zeros if not declared
+        :type row: list
+        :return: last row of best values and decisions rows, indexed by capacity minus stock cost
+        :rtype: tuple
+        """
+        if self.get_backend(backend) == 'numpy':
+            return self.knapsack_table_numpy(costs, values, capacity, memory_lean, row)
+        if row is None:
+            row = array('q', bytes(8 * (capacity + 1))) if memory_lean else [0] * (capacity + 1)
+        decisions = []
+        for cost, value in zip(costs, values):
+            if cost < 0 or cost > capacity:
+                decisions.append(b'')
+                continue
+            previous = row[cost:]
+            # row still holds the values without the current stock while the new values are computed
+            updated = list(map(max, previous, map(add, row, repeat(value, capacity + 1 - cost))))
+            decisions_row = bytes(map(lt, previous, updated))
+            if memory_lean:
+                decisions.append(self.pack_decisions(decisions_row))
+                row[cost:] = array('q', updated)
+            else:
+                decisions.append(decisions_row)
+                row[cost:] = updated
+        return row, decisions
 
-            # We update the remaining limit based on the ongoing quantity purchase test
-            total_cost = self.common_functions.calculate_total_cost(
-                purchase_list, stock_names_list, stocks_dict
-            )
+    @staticmethod
+    def knapsack_table_numpy(costs: list, values: list, capacity: int, memory_lean: bool = False, row=None) -> tuple:
+        """
+        NumPy version of knapsack_table: each stock updates the row with a single vectorized np.maximum
+        :param costs: stock costs in integer budget units
+        :type costs: list
+        :param values: stock gains as integers
+        :type values: list
+        :param capacity: purchase limit in integer budget units
+        :type capacity: int
+        :param memory_lean: stores decisions as packed bitsets (np.packbits) instead of boolean arrays
+        :type memory_lean: bool
+        :param row: best values row of previous stocks, updated in place, zeros if not declared
+        :type row: numpy.ndarray
+        :return: last row of best values and decisions rows, indexed by capacity minus stock cost
+        :rtype: tuple
+        """
+        row = np.zeros(capacity + 1, dtype=np.int64) if row is None else row
+        decisions = []
+        for cost, value in zip(costs, values):
+            if cost < 0 or cost > capacity:
+                decisions.append(b'')
+                continue
+            # The addition allocates a new array, row can then be updated in place
+            shifted_row = row[:capacity + 1 - cost] + value
+            taken = shifted_row > row[cost:]
+            np.maximum(row[cost:], shifted_row, out=row[cost:])
+            decisions.append(np.packbits(taken, bitorder='little') if memory_lean else taken)
+        return row, decisions
 
-            # if we come below the purchase limit, then we calculate the gain and compare
-            # it to the best gain obtained
-            if total_cost < purchase_limit:
-                # Calculate best gain seen so far
-                best_gain = self.common_functions.calculate_total_gain(
-                    stock_names_list=stock_names_list,
-                    stocks_dict=stocks_dict,
-                    purchase_list=best_list
-                )
+    @staticmethod
+    def get_backend(backend: str = None) -> str:
+        """
+        Gets the knapsack backend to be used
+        :param backend: requested backend, 'numpy' or 'python'
+        :type backend: str
+        :return: requested backend, numpy when installed if not declared
+        :rtype: str
+        """
+        if backend is None:
+            return 'python' if np is None else 'numpy'
+        if backend == 'numpy' and np is None:
+            raise ImportError("numpy backend requested but numpy is not installed")
+        if backend not in ('numpy', 'python'):
+            raise ValueError(f"unknown knapsack backend: {backend}")
+        return backend
 
-                # Calculate current gain
-                current_gain = self.common_functions.calculate_total_gain(
-                    purchase_list=purchase_list,
-                    stock_names_list=stock_names_list,
-                    stocks_dict=stocks_dict
-                )
+    @staticmethod
+    def knapsack_backtrack(costs: list, decisions: list, capacity: int, memory_lean: bool = False) -> list:
+        """
+        Rebuilds the purchase list from the decisions rows of the knapsack table
+        :param costs: stock costs in integer budget units
+        :type costs: list
+        :param decisions: decisions rows returned by knapsack_table
+        :type decisions: list
+        :param capacity: purchase limit in integer budget units
+        :type capacity: int
+        :param memory_lean: decisions rows are packed bitsets
+        :type memory_lean: bool
+        :return: purchase quantity (0 or 1) for each stock
+        :rtype: list
+        """
+        purchase_list = [0] * len(costs)
+        remaining = capacity
+        for stock_index in reversed(range(len(costs))):
+            cost = costs[stock_index]
+            decision = decisions[stock_index]
+            if len(decision) == 0 or remaining < cost:
+                continue
+            cell = remaining - cost
+            if (decision[cell >> 3] >> (cell & 7) & 1) if memory_lean else decision[cell]:
+                purchase_list[stock_index] = 1
+                remaining -= cost
+        return purchase_list
+
+    def knapsack_calculation(
+            self,
+            purchase_limit: float,
+            stocks: Stocks,
+            precision: int = 2,
+            memory_lean: bool = False,
+            backend: str = None,
+            stats: SolveStats = None
+    ) -> list:
+        """
+        Calculates the best purchase option with a 0/1 knapsack dynamic programming in O(n * W) time, W being the
+        purchase limit expressed in integer budget units (cents with the default precision).
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: float
+        :param stocks: all stock data
+        :type stocks: Stocks
+        :param precision: number of decimals kept on prices and gains
+        :type precision: int
+        :param memory_lean: keeps the decisions table as a bitset, see knapsack_table
+        :type memory_lean: bool
+        :param backend: 'numpy' or 'python', numpy when installed if not declared
+        :type backend: str
+        :param stats: collects the preprocess, solve and backtrack times and the number of DP cells computed
+        :type stats: SolveStats
+        :return: best purchase list
+        :rtype: list
+        """
+        with measure_phase(stats, 'preprocess'):
+            costs, values = self.to_knapsack_units(stocks, precision)
+            capacity = round(purchase_limit * 10 ** precision)
+        with measure_phase(stats, 'solve'):
+            _, decisions = self.knapsack_table(costs, values, capacity, memory_lean, backend)
+        if stats is not None:
+            stats.count('dp_cells', sum(capacity - cost + 1 for cost in costs if 0 <= cost <= capacity))
+        with measure_phase(stats, 'backtrack'):
+            return self.knapsack_backtrack(costs, decisions, capacity, memory_lean)
 
-                # If the current gain is better than the best found so far, we update
-                # the best purchase list with the ongoing purchase test
-                if current_gain > best_gain:
-                    best_list = purchase_list.copy()
-
-            # if we are not at then end of the list of stocks we recursively call the function
-            if stock_index < len(stock_names_list) - 1:
-                new_best_list = self.optimized_calculation(
-                    purchase_limit=purchase_limit,
-                    stock_index=stock_index + 1,
-                    stock_names_list=stock_names_list,
-                    purchase_list=purchase_list,
-                    stocks_dict=stocks_dict,
-                    best_list=best_list
-                )
-                new_best_gain = self.common_functions.calculate_total_gain(
-                    purchase_list=new_best_list, stock_names_list=stock_names_list, stocks_dict=stocks_dict)
-                if new_best_gain > best_gain:
-                    best_list = new_best_list.copy()
-                    best_gain = self.common_functions.calculate_total_gain(stock_names_list, stocks_dict, best_list)
-            print(best_list)
-            # print(best_gain)
-            # print(purchase_list)
-            # print(remaining_limit)
-
-        # We set the stock purchase quantity back to initial value in order to test over
-        purchase_list[stock_index] = 1
+    @staticmethod
+    def to_knapsack_units(stocks: Stocks, precision: int = 2) -> tuple:
+        """
+        Converts stock prices and gains into the integers used by the knapsack table
+        :param stocks: all stock data
+        :type stocks: Stocks
+        :param precision: number of decimals kept on prices and gains
+        :type precision: int
+        :return: costs in budget units and values
+        :rtype: tuple
+        """
+        scale = 10 ** precision
+        costs = [round(cost * scale) for cost in stocks.costs]
+        # Gains are price * gain percentage, both scaled, so the values stay exact integers
+        values = [cost * round(profit * scale) for cost, profit in zip(costs, stocks.profits)]
+        return costs, values
 
-        return best_list
+    def batch_knapsack_calculation(
+            self,
+            purchase_limits: list,
+            stocks: Stocks,
+            precision: int = 2,
+            memory_lean: bool = False,
+            backend: str = None
+    ) -> dict:
+        """
+        Calculates the best purchase option for several purchase limits with a single knapsack table filled up to
+        the largest limit: the table cell of a smaller limit holds its optimum, backtracking from it gives its
+        purchase list. K limits cost one table and K backtracks of O(n).
+        :param purchase_limits: maximum amounts to be expended in stock purchases
+        :type purchase_limits: list
+        :param stocks: all stock data
+        :type stocks: Stocks
+        :param precision: number of decimals kept on prices and gains
+        :type precision: int
+        :param memory_lean: keeps the decisions table as a bitset, see knapsack_table
+        :type memory_lean: bool
+        :param backend: 'numpy' or 'python', numpy when installed if not declared
+        :type backend: str
+        :return: best purchase list of each purchase limit
+        :rtype: dict
+        """
+        if not purchase_limits:
+            return {}
+        costs, values = self.to_knapsack_units(stocks, precision)
+        scale = 10 ** precision
+        _, decisions = self.knapsack_table(
+            costs, values, round(max(purchase_limits) * scale), memory_lean, backend)
+        return {
+            purchase_limit: self.knapsack_backtrack(costs, decisions, round(purchase_limit * scale), memory_lean)
+            for purchase_limit in purchase_limits
+        }
 
-    def run_optimized(self):
-        dict_stocks = self.common_functions.csv_to_dict(self.common_functions.DATASET_FILE)
-        dict_stocks_sorted = self.sort_dict_by_gain(dict_stocks)
-        stock_names_list = self.common_functions.stock_dict_to_stock_name_list(dict_stocks_sorted)
-        best_list = self.optimized_calculation(
-            500,
-            0,
-            stock_names_list,
-            dict_stocks_sorted
-        )
-        print(stock_names_list)
-        print(best_list)
-        best_gain = self.common_functions.calculate_total_gain(stock_names_list, dict_stocks_sorted, best_list)
-        print(best_gain)
+    @staticmethod
+    def split_quantities(max_quantities: list) -> tuple:
+        """
+        Splits each stock maximum quantity into binary bundles 1, 2, 4... plus the remainder, so that any
+        quantity from 0 to the maximum is a sum of distinct bundles: a stock bought up to q times becomes
+        O(log q) 0/1 items
+        :param max_quantities: maximum quantity of each stock
+        :type max_quantities: list
+        :return: stock position and quantity of each bundle
+        :rtype: tuple
+        """
+        bundle_stocks = []
+        bundle_sizes = []
+        for stock_index, max_quantity in enumerate(max_quantities):
+            size = 1
+            while max_quantity > 0:
+                size = min(size, max_quantity)
+                bundle_stocks.append(stock_index)
+                bundle_sizes.append(size)
+                max_quantity -= size
+                size *= 2
+        return bundle_stocks, bundle_sizes
+
+    def bounded_knapsack_calculation(
+            self,
+            purchase_limit: float,
+            stocks: Stocks,
+            max_quantities,
+            precision: int = 2,
+            memory_lean: bool = False,
+            backend: str = None,
+            stats: SolveStats = None
+    ) -> list:
+        """
+        Calculates the best purchase quantities when each stock can be bought several times, up to its maximum
+        quantity. Quantities are split into binary bundles (see split_quantities) solved by the 0/1 knapsack table,
+        so the time grows with the logarithm of the quantities instead of the quantities. The dominance pruning of
+        CommonFunctions.sanitize_stocks assumes single units: stocks must not be sanitized before this calculation.
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: float
+        :param stocks: all stock data
+        :type stocks: Stocks
+        :param max_quantities: maximum quantity of each stock, or the same maximum for all stocks
+        :type max_quantities: list
+        :param precision: number of decimals kept on prices and gains
+        :type precision: int
+        :param memory_lean: keeps the decisions table as a bitset, see knapsack_table
+        :type memory_lean: bool
+        :param backend: 'numpy' or 'python', numpy when installed if not declared
+        :type backend: str
+        :param stats: collects the preprocess, solve and backtrack times and the number of DP cells computed
+        :type stats: SolveStats
+        :return: purchase quantity of each stock
+        :rtype: list
+        """
+        with measure_phase(stats, 'preprocess'):
+            if isinstance(max_quantities, int):
+                max_quantities = [max_quantities] * len(stocks)
+            if len(max_quantities) != len(stocks):
+                raise ValueError("one maximum quantity is expected per stock")
+            costs, values = self.to_knapsack_units(stocks, precision)
+            capacity = round(purchase_limit * 10 ** precision)
+            # More units of a stock than the purchase limit can hold are never bought
+            max_quantities = [
+                min(max_quantity, capacity // cost) if cost > 0 else min(max_quantity, 1)
+                for max_quantity, cost in zip(max_quantities, costs)
+            ]
+            bundle_stocks, bundle_sizes = self.split_quantities(max_quantities)
+            bundle_costs = [costs[stock_index] * size for stock_index, size in zip(bundle_stocks, bundle_sizes)]
+            bundle_values = [values[stock_index] * size for stock_index, size in zip(bundle_stocks, bundle_sizes)]
+        with measure_phase(stats, 'solve'):
+            _, decisions = self.knapsack_table(bundle_costs, bundle_values, capacity, memory_lean, backend)
+        if stats is not None:
+            stats.count('dp_cells', sum(capacity - cost + 1 for cost in bundle_costs if 0 <= cost <= capacity))
+        with measure_phase(stats, 'backtrack'):
+            bundles = self.knapsack_backtrack(bundle_costs, decisions, capacity, memory_lean)
+            quantities = [0] * len(stocks)
+            for stock_index, size, taken in zip(bundle_stocks, bundle_sizes, bundles):
+                if taken:
+                    quantities[stock_index] += size
+            return quantities
+
+    def run_optimized(
+            self,
+            file_path: str = None,
+            purchase_limit: float = 500,
+            memory_lean: bool = False,
+            sanitize: bool = True,
+            cache: SolveCache = None,
+            stats: SolveStats = None,
+            cache_path: str = SolveCache.DEFAULT_PATH
+    ):
+        """
+        Solves a csv dataset with the knapsack, through a solve cache: results of the same stocks and purchase limit
+        are read back instead of solved again, across runs with the cache file
+        :param file_path: csv dataset, DATASET_FILE if not declared
+        :type file_path: str
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: float
+        :param memory_lean: keeps the decisions table as a bitset, see knapsack_table
+        :type memory_lean: bool
+        :param sanitize: filters the stocks that cannot be part of a best purchase list first
+        :type sanitize: bool
+        :param cache: solve cache, a cache on cache_path opened and closed by the run if not declared
+        :type cache: SolveCache
+        :param stats: collects the phase times and the counters
+        :type stats: SolveStats
+        :param cache_path: sqlite file of the cache opened by the run, no cache if None
+        :type cache_path: str
+        :return: best purchase list
+        :rtype: list
+        """
+        file_path = file_path if file_path else self.common_functions.DATASET_FILE
+        with measure_phase(stats, 'load'):
+            stocks = self.common_functions.csv_to_stocks(file_path)
+        if sanitize:
+            with measure_phase(stats, 'preprocess'):
+                stocks, report = self.common_functions.sanitize_stocks(stocks, purchase_limit)
+            logger.info("sanitized stocks: %s", report)
+        run_cache = cache if cache is not None or cache_path is None else SolveCache(cache_path)
+        if run_cache is None:
+            best_list = self.knapsack_calculation(purchase_limit, stocks, memory_lean=memory_lean, stats=stats)
+            gain = stocks.total_gain(best_list)
+        else:
+            # Memory lean mode and backend do not change the purchase list, only the precision does
+            best_list, gain = run_cache.cached_calculation(
+                lambda limit, cached_stocks: self.knapsack_calculation(
+                    limit, cached_stocks, memory_lean=memory_lean, stats=stats),
+                purchase_limit, stocks, {'solver': 'knapsack', 'precision': 2}, stats
+            )
+            if cache is None:
+                run_cache.close()
+        print(stocks.purchased_names(best_list))
+        print(gain)
+        print("--- peak RSS %s MB ---" % self.common_functions.get_peak_memory())
         return best_list
 
 
@@ -196,23 +513,19 @@ def main():
 
     # Initialize controllers
     common_functions = CommonFunctions()
-    optimized_calculation = Optimized(common_functions)
-
-    # Start run as a process
-    p = multiprocessing.Process(target=optimized_calculation.run_optimized, name="run_optimized")
-    p.start()
-
-    # Wait x seconds for the process
-    # time.sleep(10)
-    p.join(3)
-
-    # Terminate foo
-    if p.is_alive():
-        print("foo is running... let's kill it...")
-
-        # Terminate foo
-        p.terminate()
-        p.join()
+    anytime_solver = AnytimeSolver(common_functions)
+
+    # Exact optimum, read back from the solve cache file after the first run
+    Optimized(common_functions).run_optimized()
+    stocks = common_functions.csv_to_stocks(common_functions.DATASET_FILE)
+    stocks, report = common_functions.sanitize_stocks(stocks, 500)
+
+    # Search for 3 seconds at most, keeping the best purchase list found when time is up
+    result = anytime_solver.anytime_calculation(500, stocks, 3)
+    print(stocks.purchased_names(result.purchase_list))
+    print(result.gain)
+    if not result.proven_optimal:
+        print("time is up, gap to upper bound: %.4f%%" % (100 * result.gap))
 
     print("--- %s seconds ---" % (time.time() - start_time))
 
@@ -0,0 +1,346 @@
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+
+from bruteforce import CommonFunctions
+from branchandbound import BranchAndBound
+from cache import SolveCache
+from certification import certify
+from heuristic import Heuristic
+from optimized import Optimized
+
+
+SERVICE_DATASETS = ["test_datasets/dataset0.csv", "test_datasets/dataset1.csv", "test_datasets/dataset2.csv"]
+SERVICE_SOLVERS = ('knapsack', 'branch_and_bound', 'heuristic')
+# Sanitized stocks kept per worker, by dataset and purchase limit, the least recently used ones being dropped
+SANITIZED_CACHE_SIZE = 16
+
+logger = logging.getLogger(__name__)
+
+
+# Stocks and controllers preloaded in each worker process, set by init_service_worker
+worker_state = {}
+
+
+def dataset_name(file_path: str) -> str:
+    """
+    Gets the name a dataset is requested by: its file name without extension
+    :param file_path: csv dataset
+    :type file_path: str
+    :return: dataset name
+    :rtype: str
+    """
+    return os.path.splitext(os.path.basename(file_path))[0]
+
+
+def init_service_worker(file_paths: list):
+    """
+    Loads the datasets once in a worker process, so that solves pay neither process startup nor csv parsing
+    :param file_paths: csv datasets to be served
+    :type file_paths: list
+    """
+    common_functions = CommonFunctions()
+    worker_state['common_functions'] = common_functions
+    worker_state['stocks'] = {dataset_name(file_path): common_functions.csv_to_stocks(file_path)
+                              for file_path in file_paths}
+    worker_state['sanitized'] = OrderedDict()
+    worker_state['solvers'] = {
+        'knapsack': Optimized(common_functions).knapsack_calculation,
+        'branch_and_bound': BranchAndBound(common_functions).branch_and_bound_calculation,
+        'heuristic': Heuristic(common_functions).heuristic_calculation,
+    }
+
+
+def solve_in_worker(dataset: str, purchase_limit: float, solver_name: str) -> dict:
+    """
+    Solves a preloaded dataset in a worker process, the sanitized stocks of the last SANITIZED_CACHE_SIZE datasets
+    and purchase limits being kept
+    :param dataset: dataset name
+    :type dataset: str
+    :param purchase_limit: maximum amount to be expended in stock purchases
+    :type purchase_limit: float
+    :param solver_name: one of SERVICE_SOLVERS
+    :type solver_name: str
+    :return: purchased stock names, total cost, total gain, LP relaxation upper bound and gap to it
+    :rtype: dict
+    """
+    key = (dataset, purchase_limit)
+    sanitized = worker_state['sanitized']
+    if key in sanitized:
+        sanitized.move_to_end(key)
+    else:
+        sanitized[key], _ = worker_state['common_functions'].sanitize_stocks(
+            worker_state['stocks'][dataset], purchase_limit)
+        if len(sanitized) > SANITIZED_CACHE_SIZE:
+            sanitized.popitem(last=False)
+    stocks = sanitized[key]
+    purchase_list = worker_state['solvers'][solver_name](purchase_limit, stocks)
+    certificate = certify(purchase_limit, stocks, purchase_list)
+    return {
+        'purchased': stocks.purchased_names(purchase_list),
+        'cost': stocks.total_cost(purchase_list),
+        'gain': certificate.gain,
+        'upper_bound': certificate.upper_bound,
+        'gap': certificate.gap
+    }
+
+
+class SolveService:
+    """
+    Asyncio solve service in front of a warm process pool. Identical concurrent requests share one solve,
+    finished results are kept in an LRU cache and each request waits at most until its deadline.
+    """
+
+    # Seconds a request waits for its result if it does not declare a deadline
+    DEFAULT_TIMEOUT = 10.0
+    # Largest request body accepted, in bytes
+    MAX_BODY_SIZE = 64 * 1024
+    # Largest purchase limit accepted: the knapsack table holds one cell per stock and per cent of the limit, a worker
+    # peaks at about 410 MB on dataset1 (738 sanitized stocks) at this limit
+    MAX_PURCHASE_LIMIT = 5000
+
+    def __init__(self, file_paths: list = None, max_workers: int = None, cache_size: int = 1024):
+        """
+        :param file_paths: csv datasets to be served
+        :type file_paths: list
+        :param max_workers: number of worker processes, number of cores if not declared
+        :type max_workers: int
+        :param cache_size: number of results kept in memory
+        :type cache_size: int
+        """
+        self.file_paths = file_paths if file_paths else SERVICE_DATASETS
+        self.datasets = {dataset_name(file_path) for file_path in self.file_paths}
+        self.max_workers = max_workers if max_workers else os.cpu_count()
+        self.cache = SolveCache(memory_size=cache_size)
+        self.executor = None
+        self.pending = {}
+        self.coalesced = 0
+
+    async def start(self):
+        """
+        Starts the worker processes and waits until each one has loaded the datasets
+        """
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.max_workers, initializer=init_service_worker, initargs=(self.file_paths,)
+        )
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.executor, os.getpid) for _ in range(self.max_workers)))
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+        self.cache.close()
+
+    @classmethod
+    def check_purchase_limit(cls, purchase_limit) -> float:
+        """
+        Checks a requested purchase limit before it reaches a worker
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: float
+        :return: purchase limit as a float
+        :rtype: float
+        """
+        purchase_limit = float(purchase_limit)
+        if not math.isfinite(purchase_limit) or not 0 <= purchase_limit <= cls.MAX_PURCHASE_LIMIT:
+            raise ValueError(f"purchase_limit must be a number from 0 to {cls.MAX_PURCHASE_LIMIT}")
+        return purchase_limit
+
+    async def solve(self, dataset: str, purchase_limit: float, solver_name: str = 'knapsack',
+                    timeout: float = None) -> dict:
+        """
+        Gets the result of a problem: from the cache, from an identical solve already running, or from a new solve.
+        The solve keeps running when a request reaches its deadline, for the other requests waiting for it and
+        for the cache.
+        :param dataset: dataset name
+        :type dataset: str
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: float
+        :param solver_name: one of SERVICE_SOLVERS
+        :type solver_name: str
+        :param timeout: seconds allowed to the request, DEFAULT_TIMEOUT if not declared
+        :type timeout: float
+        :return: purchased stock names, total cost, total gain, LP relaxation upper bound and gap to it
+        :rtype: dict
+        """
+        if dataset not in self.datasets:
+            raise KeyError(f"unknown dataset {dataset}")
+        if solver_name not in SERVICE_SOLVERS:
+            raise KeyError(f"unknown solver {solver_name}")
+        purchase_limit = self.check_purchase_limit(purchase_limit)
+        key = json.dumps([dataset, purchase_limit, solver_name])
+        result = self.cache.get(key)
+        if result is not None:
+            return result[0]
+
+        task = self.pending.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().run_in_executor(
+                self.executor, solve_in_worker, dataset, purchase_limit, solver_name)
+            self.pending[key] = task
+            task.add_done_callback(lambda done: self.store_result(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.wait_for(asyncio.shield(task), self.DEFAULT_TIMEOUT if timeout is None else timeout)
+
+    def store_result(self, key: str, task: asyncio.Future):
+        """
+        Caches a finished solve and removes it from the running ones
+        :param key: problem key
+        :type key: str
+        :param task: finished solve
+        :type task: asyncio.Future
+        """
+        del self.pending[key]
+        if not task.cancelled() and task.exception() is None:
+            result = task.result()
+            self.cache.store_in_memory(key, (result, result['gain']))
+
+    def parse_request(self, body: bytes) -> tuple:
+        """
+        Reads and checks the JSON body of a solve request, so that only valid problems reach the workers
+        :param body: request body
+        :type body: bytes
+        :return: dataset, purchase limit, solver name and timeout, arguments of solve
+        :rtype: tuple
+        """
+        request = json.loads(body)
+        if not isinstance(request, dict):
+            raise ValueError("the request body must be a JSON object")
+        dataset = request.get('dataset')
+        if dataset not in self.datasets:
+            raise KeyError(f"unknown dataset {dataset}")
+        solver_name = request.get('solver', 'knapsack')
+        if solver_name not in SERVICE_SOLVERS:
+            raise KeyError(f"unknown solver {solver_name}")
+        timeout = request.get('timeout')
+        if timeout is not None:
+            timeout = float(timeout)
+            if not math.isfinite(timeout) or timeout <= 0:
+                raise ValueError("timeout must be a positive number of seconds")
+        return dataset, self.check_purchase_limit(request.get('purchase_limit', 500)), solver_name, timeout
+
+    async def handle_request(self, method: str, path: str, body: bytes) -> tuple:
+        """
+        Routes an HTTP request: POST /solve with a JSON body {"dataset", "purchase_limit", "solver", "timeout"},
+        GET /stats for the cache and coalescing counters
+        :param method: HTTP method
+        :type method: str
+        :param path: request path
+        :type path: str
+        :param body: request body
+        :type body: bytes
+        :return: HTTP status and JSON response
+        :rtype: tuple
+        """
+        if path == '/stats' and method == 'GET':
+            return HTTPStatus.OK, {'cache_hits': self.cache.hits, 'cache_misses': self.cache.misses,
+                                   'coalesced': self.coalesced, 'running': len(self.pending)}
+        if path != '/solve':
+            return HTTPStatus.NOT_FOUND, {'error': f"unknown path {path}"}
+        if method != 'POST':
+            return HTTPStatus.METHOD_NOT_ALLOWED, {'error': "use POST"}
+        try:
+            request = self.parse_request(body)
+        except (ValueError, TypeError, KeyError) as error:
+            return HTTPStatus.BAD_REQUEST, {'error': str(error)}
+        try:
+            result = await self.solve(*request)
+        except asyncio.TimeoutError:
+            return HTTPStatus.GATEWAY_TIMEOUT, {'error': "deadline exceeded"}
+        except Exception as error:
+            # A failed solve, or a broken worker pool, answers the request instead of dropping the connection
+            logger.exception("solve failed")
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {'error': f"solve failed: {type(error).__name__}"}
+        return HTTPStatus.OK, result
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Serves the HTTP/1.1 requests of a connection, kept alive until the client closes it
+        :param reader: connection input
+        :type reader: asyncio.StreamReader
+        :param writer: connection output
+        :type writer: asyncio.StreamWriter
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body_size = int(headers.get('content-length', 0))
+                if body_size > self.MAX_BODY_SIZE:
+                    status, response = HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {'error': "body too large"}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(body_size)
+                    status, response = await self.handle_request(method, path, body)
+                    keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                payload = json.dumps(response).encode()
+                writer.write(
+                    f"HTTP/1.1 {status.value} {status.phrase}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(payload)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}"
+                    f"\r\n\r\n".encode('latin-1') + payload
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8765, unix_path: str = None):
+        """
+        Starts the worker processes then serves requests on a local TCP port or on a Unix socket until cancelled
+        :param host: TCP address
+        :type host: str
+        :param port: TCP port
+        :type port: int
+        :param unix_path: Unix socket file, used instead of the TCP port if declared
+        :type unix_path: str
+        """
+        await self.start()
+        if unix_path:
+            server = await asyncio.start_unix_server(self.handle_connection, path=unix_path)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+        print("serving on %s" % (unix_path if unix_path else f"http://{host}:{port}"))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves purchase optimizations over HTTP")
+    parser.add_argument('--host', default='127.0.0.1', help="TCP address")
+    parser.add_argument('--port', type=int, default=8765, help="TCP port")
+    parser.add_argument('--unix', help="Unix socket file, used instead of the TCP port")
+    parser.add_argument('--workers', type=int, help="number of worker processes")
+    parser.add_argument('--datasets', nargs='*', help="csv datasets to be served")
+    arguments = parser.parse_args()
+    try:
+        asyncio.run(SolveService(arguments.datasets, arguments.workers).serve(arguments.host, arguments.port,
+                                                                              arguments.unix))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
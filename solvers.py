@@ -0,0 +1,61 @@
+from anytime import AnytimeSolver
+from branchandbound import BranchAndBound
+from bruteforce import BruteForceCalculation, CommonFunctions, Stocks
+from heuristic import Heuristic
+from incremental import IncrementalKnapsack
+from meetinthemiddle import MeetInTheMiddle
+from multiconstraint import MultiConstraintSolver, PortfolioConstraints
+from optimized import Optimized
+
+
+# Seconds allowed to the anytime solver, which returns earlier once its purchase list is proven optimal
+ANYTIME_TIME_LIMIT = 3
+
+
+def get_solvers(common_functions: CommonFunctions) -> list:
+    """
+    Gets every solver, for the benchmark suite and the differential test. The maximum number of stocks keeps the
+    exponential solvers and the pure python knapsack to instances solved within seconds.
+    :param common_functions: common functions controller
+    :type common_functions: CommonFunctions
+    :return: (name, function(purchase_limit, stocks) returning a purchase list, maximum number of stocks (None for
+    no maximum), whether the solver is exact, whether it needs positive prices (see
+    certification.to_positive_prices)) tuples
+    :rtype: list
+    """
+    brute_force = BruteForceCalculation(common_functions)
+    optimized = Optimized(common_functions)
+    meet_in_the_middle = MeetInTheMiddle(common_functions)
+    branch_and_bound = BranchAndBound(common_functions)
+    anytime_solver = AnytimeSolver(common_functions)
+    multi_constraint = MultiConstraintSolver(common_functions)
+    heuristic = Heuristic(common_functions)
+
+    def legacy_calculation(purchase_limit: float, stocks: Stocks) -> list:
+        stocks_dict = {name: {'Cout': cost, 'Benefice': profit}
+                       for name, cost, profit in zip(stocks.names, stocks.costs, stocks.profits)}
+        return optimized.optimized_calculation(
+            purchase_limit, 0, 0, list(stocks.names), list(stocks.costs), stocks_dict)
+
+    return [
+        ('brute_force', lambda purchase_limit, stocks: brute_force.brute_force_calculation(
+            purchase_limit, 0, stocks), 16, True, False),
+        ('optimized_calculation', legacy_calculation, 16, True, False),
+        ('meet_in_the_middle', meet_in_the_middle.meet_in_the_middle_calculation, 60, True, False),
+        ('knapsack_python', lambda purchase_limit, stocks: optimized.knapsack_calculation(
+            purchase_limit, stocks, backend='python'), 20, True, True),
+        ('knapsack', optimized.knapsack_calculation, None, True, True),
+        ('knapsack_memory_lean', lambda purchase_limit, stocks: optimized.knapsack_calculation(
+            purchase_limit, stocks, memory_lean=True), None, True, True),
+        ('bounded_knapsack', lambda purchase_limit, stocks: optimized.bounded_knapsack_calculation(
+            purchase_limit, stocks, 1), None, True, True),
+        ('incremental_knapsack', lambda purchase_limit, stocks: IncrementalKnapsack(
+            common_functions).solve(purchase_limit, stocks), None, True, True),
+        ('branch_and_bound', branch_and_bound.branch_and_bound_calculation, None, True, True),
+        ('parallel_branch_and_bound', branch_and_bound.parallel_branch_and_bound_calculation, None, True, True),
+        ('anytime', lambda purchase_limit, stocks: anytime_solver.anytime_calculation(
+            purchase_limit, stocks, ANYTIME_TIME_LIMIT).purchase_list, None, False, True),
+        ('multi_constraint', lambda purchase_limit, stocks: multi_constraint.multi_constraint_calculation(
+            purchase_limit, stocks, PortfolioConstraints()).purchase_list, None, True, True),
+        ('heuristic', heuristic.heuristic_calculation, None, False, True),
+    ]
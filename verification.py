@@ -0,0 +1,406 @@
+import argparse
+import random
+import sys
+import time
+
+from array import array
+from itertools import product
+
+from bruteforce import BruteForceCalculation, CommonFunctions, Stocks
+from certification import (
+    GAIN_TOLERANCE, Certificate, certify, from_positive_prices, gains_agree, lp_upper_bound, to_positive_prices
+)
+from incremental import IncrementalKnapsack
+from multiconstraint import MultiConstraintSolver, PortfolioConstraints
+from optimized import Optimized
+from solvers import get_solvers
+
+
+class SolverVerification:
+    """
+    Differential test of every solver against an exact reference on random instances, each result being
+    certified against the LP relaxation (see certification.certify). Instances may hold negative prices, negative
+    gains and ties: the solvers ignoring stocks with a non positive price or gain are run on the equivalent positive
+    instance (see certification.to_positive_prices), the others on the instance itself.
+    """
+
+    # Largest instance checked against the brute force, larger ones are checked against the knapsack table
+    BRUTE_FORCE_MAX_SIZE = 12
+    # Largest instance and largest maximum quantity of the multiple units instances, checked against the brute force
+    BOUNDED_MAX_SIZE = 8
+    BOUNDED_MAX_QUANTITY = 4
+    # Largest instance with compliance rules, checked against all the purchase lists
+    CONSTRAINED_MAX_SIZE = 12
+
+    def __init__(self, common_functions: CommonFunctions):
+        self.common_functions = common_functions
+        self.optimized = Optimized(common_functions)
+
+    @staticmethod
+    def generate_instance(generator: random.Random, stocks_count: int) -> tuple:
+        """
+        Generates a random instance with 2 decimals prices and gain percentages. Some prices are zero or negative,
+        some gains are negative, and ties are frequent: repeated stocks, repeated prices and repeated gain
+        percentages (equal gain / price ratios).
+        :param generator: random generator, the same seed gives the same instances
+        :type generator: random.Random
+        :param stocks_count: number of stocks
+        :type stocks_count: int
+        :return: stocks and purchase limit
+        :rtype: tuple
+        """
+        shared_prices = [generator.randint(1, 10000) / 100 for _ in range(3)]
+        shared_profits = [generator.randint(-500, 5000) / 100 for _ in range(3)]
+        costs = []
+        profits = []
+        for _ in range(stocks_count):
+            if costs and generator.random() < 0.1:
+                stock_index = generator.randrange(len(costs))
+                costs.append(costs[stock_index])
+                profits.append(profits[stock_index])
+                continue
+            draw = generator.random()
+            if draw < 0.1:
+                costs.append(generator.randint(-3000, -1) / 100)
+            elif draw < 0.15:
+                costs.append(0.0)
+            elif draw < 0.3:
+                costs.append(generator.choice(shared_prices))
+            else:
+                costs.append(generator.randint(1, 10000) / 100)
+            draw = generator.random()
+            if draw < 0.1:
+                profits.append(generator.randint(-1000, -1) / 100)
+            elif draw < 0.35:
+                profits.append(generator.choice(shared_profits))
+            else:
+                profits.append(generator.randint(0, 5000) / 100)
+        positive_total = sum(cost for cost in costs if cost > 0)
+        purchase_limit = round(positive_total * generator.uniform(0.1, 0.7), 2)
+        return Stocks(tuple(f"Share-{stock_index}" for stock_index in range(stocks_count)), array('d', costs),
+                      array('d', profits)), purchase_limit
+
+    def reference_calculation(self, purchase_limit: float, stocks: Stocks) -> list:
+        """
+        Calculates the exact best purchase list: by brute force on small instances, by the knapsack table on the
+        positive instance otherwise (exact on 2 decimals prices and gain percentages)
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: float
+        :param stocks: all stock data
+        :type stocks: Stocks
+        :return: best purchase list
+        :rtype: list
+        """
+        if len(stocks) <= self.BRUTE_FORCE_MAX_SIZE:
+            return BruteForceCalculation(self.common_functions).brute_force_calculation(purchase_limit, 0, stocks)
+        positive_stocks, positive_limit, *mapping = to_positive_prices(purchase_limit, stocks)
+        return from_positive_prices(
+            self.optimized.knapsack_calculation(positive_limit, positive_stocks), *mapping)
+
+    def verify_instance(self, purchase_limit: float, stocks: Stocks, solvers: list = None) -> list:
+        """
+        Runs the solvers on an instance and checks each purchase list: within the limit, as good as the reference
+        for the exact solvers, and within the LP relaxation upper bound
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: float
+        :param stocks: all stock data
+        :type stocks: Stocks
+        :param solvers: solvers returned by solvers.get_solvers, all of them if not declared
+        :type solvers: list
+        :return: one result dictionary per solver
+        :rtype: list
+        """
+        solvers = solvers if solvers else get_solvers(self.common_functions)
+        reference_gain = stocks.total_gain(self.reference_calculation(purchase_limit, stocks))
+        tolerance = GAIN_TOLERANCE * max(1.0, abs(reference_gain))
+        positive_stocks, positive_limit, *mapping = to_positive_prices(purchase_limit, stocks)
+
+        results = []
+        for solver_name, solver, max_count, exact, positive_only in solvers:
+            if max_count is not None and len(stocks) > max_count:
+                continue
+            start_time = time.perf_counter()
+            if positive_only:
+                purchase_list = from_positive_prices(solver(positive_limit, positive_stocks), *mapping)
+            else:
+                purchase_list = solver(purchase_limit, stocks)
+            wall_time = time.perf_counter() - start_time
+            certificate = certify(purchase_limit, stocks, purchase_list)
+            agrees = gains_agree(certificate.gain, reference_gain) if exact else \
+                certificate.gain <= reference_gain + tolerance
+            results.append({
+                'stocks': len(stocks),
+                'purchase_limit': purchase_limit,
+                'solver': solver_name,
+                'exact': exact,
+                'seconds': round(wall_time, 6),
+                'gain': round(certificate.gain, 6),
+                'reference_gain': round(reference_gain, 6),
+                'upper_bound': round(certificate.upper_bound, 6),
+                'gap': round(certificate.gap, 9),
+                'feasible': certificate.feasible,
+                'agrees': agrees,
+                'bounded': certificate.gain <= certificate.upper_bound + tolerance,
+                'passed': certificate.feasible and agrees and certificate.gain <= certificate.upper_bound + tolerance
+            })
+        return results
+
+    def verify_incremental_updates(self, seed: int = 0) -> list:
+        """
+        Checks IncrementalKnapsack against a full knapsack solve after each delta of a sequence of added, changed
+        and removed stocks. The sizes cross multiples of CHECKPOINT_INTERVAL, where an update only adding stocks
+        restarts from the checkpoint after the last full block.
+        :param seed: random seed, the same seed gives the same deltas
+        :type seed: int
+        :return: one result dictionary per delta
+        :rtype: list
+        """
+        generator = random.Random(seed)
+        interval = IncrementalKnapsack.CHECKPOINT_INTERVAL
+        results = []
+        for stocks_count in (1, interval - 1, interval, 2 * interval):
+            stocks, purchase_limit = self.generate_instance(generator, stocks_count)
+            stocks, purchase_limit, _, _, _ = to_positive_prices(purchase_limit, stocks)
+            incremental = IncrementalKnapsack(self.common_functions)
+            # Some stocks are declared volatile, placed last from the start
+            purchase_list = incremental.solve(purchase_limit, stocks, volatile_names=stocks.names[::5])
+            added = 0
+            for step in range(2 * interval + 4):
+                if step % 7 == 3 and len(incremental.stocks) > 1:
+                    removed = [incremental.stocks.names[generator.randrange(len(incremental.stocks))]]
+                    purchase_list = incremental.update(removed_names=removed)
+                elif step % 7 == 5 and len(incremental.stocks):
+                    changed = incremental.stocks.select([generator.randrange(len(incremental.stocks))])
+                    purchase_list = incremental.update(Stocks(
+                        changed.names, array('d', [generator.randint(1, 10000) / 100]), changed.profits))
+                else:
+                    added += 1
+                    purchase_list = incremental.update(Stocks(
+                        (f"Added-{added}",), array('d', [generator.randint(1, 10000) / 100]),
+                        array('d', [generator.randint(1, 5000) / 100])))
+                current_stocks = incremental.stocks
+                gain = current_stocks.total_gain(purchase_list)
+                reference_gain = current_stocks.total_gain(
+                    self.optimized.knapsack_calculation(purchase_limit, current_stocks))
+                certificate = certify(purchase_limit, current_stocks, purchase_list)
+                results.append({
+                    'instance': f"incremental-{stocks_count}-{step}",
+                    'stocks': len(current_stocks),
+                    'purchase_limit': purchase_limit,
+                    'solver': 'incremental_update',
+                    'gain': round(gain, 6),
+                    'reference_gain': round(reference_gain, 6),
+                    'gap': round(certificate.gap, 9),
+                    'passed': certificate.feasible and gains_agree(gain, reference_gain)
+                })
+        return results
+
+    def generate_positive_instance(self, generator: random.Random, stocks_count: int) -> tuple:
+        """
+        Generates a random instance (see generate_instance) with at least one stock, positive prices and positive
+        gains only, for the solvers whose instance cannot be rewritten by to_positive_prices
+        :param generator: random generator, the same seed gives the same instances
+        :type generator: random.Random
+        :param stocks_count: number of stocks before the non positive ones are removed
+        :type stocks_count: int
+        :return: stocks and purchase limit
+        :rtype: tuple
+        """
+        positive_stocks = None
+        while not positive_stocks:
+            stocks, purchase_limit = self.generate_instance(generator, stocks_count)
+            positive_stocks, positive_limit, _, _, _ = to_positive_prices(purchase_limit, stocks)
+        return positive_stocks, round(positive_limit, 2)
+
+    def verify_bounded_instances(self, instances_count: int = 100, seed: int = 0) -> list:
+        """
+        Checks the bounded knapsack, with both backends, against the brute force on random instances where each
+        stock can be bought up to a random maximum quantity
+        :param instances_count: number of random instances
+        :type instances_count: int
+        :param seed: random seed, the same seed gives the same instances
+        :type seed: int
+        :return: one result dictionary per instance and solver
+        :rtype: list
+        """
+        generator = random.Random(seed)
+        brute_force = BruteForceCalculation(self.common_functions)
+        results = []
+        for instance in range(instances_count):
+            stocks, purchase_limit = self.generate_positive_instance(
+                generator, generator.randint(1, self.BOUNDED_MAX_SIZE))
+            max_quantities = [generator.randint(1, self.BOUNDED_MAX_QUANTITY) for _ in range(len(stocks))]
+            reference_gain = stocks.total_gain(brute_force.brute_force_calculation(
+                purchase_limit, 0, stocks, max_quantities=max_quantities))
+            # Each unit is a stock of the LP relaxation
+            units = stocks.select([position for position, quantity in enumerate(max_quantities)
+                                   for _ in range(quantity)])
+            upper_bound = lp_upper_bound(purchase_limit, units)
+            for solver_name, backend in (('multiple_units', None), ('multiple_units_python', 'python')):
+                purchase_list = self.optimized.bounded_knapsack_calculation(
+                    purchase_limit, stocks, max_quantities, backend=backend)
+                certificate = Certificate(
+                    stocks.total_gain(purchase_list), upper_bound,
+                    all(0 <= quantity <= max_quantity for quantity, max_quantity in zip(purchase_list, max_quantities))
+                    and stocks.total_cost(purchase_list) <= purchase_limit + GAIN_TOLERANCE
+                )
+                results.append({
+                    'instance': f"bounded-{instance}",
+                    'stocks': len(stocks),
+                    'purchase_limit': purchase_limit,
+                    'solver': solver_name,
+                    'gain': round(certificate.gain, 6),
+                    'reference_gain': round(reference_gain, 6),
+                    'gap': round(certificate.gap, 9),
+                    'passed': certificate.feasible and gains_agree(certificate.gain, reference_gain)
+                })
+        return results
+
+    @staticmethod
+    def constrained_reference_calculation(
+            purchase_limit: float, stocks: Stocks, constraints: PortfolioConstraints
+    ) -> list:
+        """
+        Calculates the exact best purchase list under the compliance rules by trying all the purchase lists
+        :param purchase_limit: maximum amount to be expended in stock purchases
+        :type purchase_limit: float
+        :param stocks: all stock data
+        :type stocks: Stocks
+        :param constraints: compliance rules
+        :type constraints: PortfolioConstraints
+        :return: best purchase list
+        :rtype: list
+        """
+        weights, capacities = constraints.side_constraints(stocks)
+        best_list = [0] * len(stocks)
+        best_gain = 0.0
+        for purchase_list in product((0, 1), repeat=len(stocks)):
+            if stocks.total_cost(purchase_list) > purchase_limit + GAIN_TOLERANCE:
+                continue
+            usage = [0.0] * len(capacities)
+            for stock_weights, quantity in zip(weights, purchase_list):
+                for constraint, weight in stock_weights if quantity else ():
+                    usage[constraint] += weight
+            gain = stocks.total_gain(purchase_list)
+            if gain > best_gain and all(
+                    used <= capacity + GAIN_TOLERANCE for used, capacity in zip(usage, capacities)):
+                best_list, best_gain = list(purchase_list), gain
+        return best_list
+
+    def verify_constrained_instances(self, instances_count: int = 100, seed: int = 0) -> list:
+        """
+        Checks the multi constraint solver against all the purchase lists on random instances with a sector column,
+        a random maximum number of positions and random sector caps. The exact method without a node limit, and the
+        branch and bound alone, must find the optimum. The default and Lagrangian methods must be feasible, find
+        the optimum when they claim it is proven, and bound it otherwise.
+        :param instances_count: number of random instances
+        :type instances_count: int
+        :param seed: random seed, the same seed gives the same instances
+        :type seed: int
+        :return: one result dictionary per instance and solver
+        :rtype: list
+        """
+        generator = random.Random(seed)
+        multi_constraint = MultiConstraintSolver(self.common_functions)
+        solvers = [
+            ('constrained_exact', lambda purchase_limit, stocks, constraints: (
+                multi_constraint.multi_constraint_calculation(
+                    purchase_limit, stocks, constraints, method='exact', max_nodes=None))),
+            ('constrained_branch_and_bound', lambda purchase_limit, stocks, constraints: (
+                multi_constraint.branch_and_bound_calculation(purchase_limit, stocks, constraints, max_nodes=None))),
+            ('constrained_default', multi_constraint.multi_constraint_calculation),
+            ('constrained_lagrangian', lambda purchase_limit, stocks, constraints: (
+                multi_constraint.multi_constraint_calculation(
+                    purchase_limit, stocks, constraints, method='lagrangian'))),
+        ]
+        results = []
+        for instance in range(instances_count):
+            stocks, purchase_limit = self.generate_positive_instance(
+                generator, generator.randint(1, self.CONSTRAINED_MAX_SIZE))
+            stocks.attributes['sector'] = tuple(generator.choice('ABC') for _ in range(len(stocks)))
+            constraints = PortfolioConstraints(
+                generator.choice([None, generator.randint(1, len(stocks))]),
+                {'sector': {sector: round(purchase_limit * generator.uniform(0.1, 0.8), 2)
+                            for sector in generator.sample('ABC', generator.randint(0, 3))}}
+            )
+            weights, capacities = constraints.side_constraints(stocks)
+            reference_gain = stocks.total_gain(self.constrained_reference_calculation(
+                purchase_limit, stocks, constraints))
+            for solver_name, solver in solvers:
+                result = solver(purchase_limit, stocks, constraints)
+                usage = [0.0] * len(capacities)
+                for stock_weights, quantity in zip(weights, result.purchase_list):
+                    for constraint, weight in stock_weights if quantity else ():
+                        usage[constraint] += weight
+                feasible = all(quantity in (0, 1) for quantity in result.purchase_list) \
+                    and stocks.total_cost(result.purchase_list) <= purchase_limit + GAIN_TOLERANCE \
+                    and all(used <= capacity + GAIN_TOLERANCE for used, capacity in zip(usage, capacities))
+                tolerance = GAIN_TOLERANCE * max(1.0, abs(reference_gain))
+                exact = solver_name in ('constrained_exact', 'constrained_branch_and_bound')
+                if exact or result.proven_optimal:
+                    agrees = result.proven_optimal and gains_agree(result.gain, reference_gain)
+                else:
+                    agrees = result.gain <= reference_gain + tolerance <= result.upper_bound + 2 * tolerance
+                results.append({
+                    'instance': f"constrained-{instance}",
+                    'stocks': len(stocks),
+                    'purchase_limit': purchase_limit,
+                    'solver': solver_name,
+                    'gain': round(result.gain, 6),
+                    'reference_gain': round(reference_gain, 6),
+                    'gap': round(certify(purchase_limit, stocks, result.purchase_list).gap, 9),
+                    'passed': feasible and agrees and gains_agree(result.gain, stocks.total_gain(result.purchase_list))
+                })
+        return results
+
+    def run_differential_test(self, instances_count: int = 200, max_size: int = 40, seed: int = 0) -> list:
+        """
+        Verifies every solver on random instances of 1 to max_size stocks
+        :param instances_count: number of random instances
+        :type instances_count: int
+        :param max_size: largest number of stocks of an instance
+        :type max_size: int
+        :param seed: random seed, the same seed gives the same instances
+        :type seed: int
+        :return: one result dictionary per instance and solver, with the instance number
+        :rtype: list
+        """
+        generator = random.Random(seed)
+        solvers = get_solvers(self.common_functions)
+        results = []
+        for instance in range(instances_count):
+            stocks, purchase_limit = self.generate_instance(generator, generator.randint(1, max_size))
+            for result in self.verify_instance(purchase_limit, stocks, solvers):
+                result['instance'] = instance
+                results.append(result)
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks every solver against an exact reference on random instances")
+    parser.add_argument('--instances', type=int, default=200, help="number of random instances")
+    parser.add_argument('--max-size', type=int, default=40, help="largest number of stocks of an instance")
+    parser.add_argument('--seed', type=int, default=0, help="random seed")
+    arguments = parser.parse_args()
+
+    verification = SolverVerification(CommonFunctions())
+    results = verification.run_differential_test(arguments.instances, arguments.max_size, arguments.seed)
+    results += verification.verify_incremental_updates(arguments.seed)
+    results += verification.verify_bounded_instances(seed=arguments.seed)
+    results += verification.verify_constrained_instances(seed=arguments.seed)
+    failures = [result for result in results if not result['passed']]
+    for solver_name in dict.fromkeys(result['solver'] for result in results):
+        solver_results = [result for result in results if result['solver'] == solver_name]
+        print(
+            f"{solver_name:<30} {len(solver_results):>5} instances "
+            f"{sum(not result['passed'] for result in solver_results):>4} failures "
+            f"mean gap to LP bound {sum(result['gap'] for result in solver_results) / len(solver_results):.6f}"
+        )
+    for result in failures:
+        print(f"FAILED instance {result['instance']}: {result}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()